@@ -8,6 +8,21 @@ from contextlib import contextmanager
 
 DEFAULT_WINDOW = 10
 
+# Lines of files read so far, path -> (mtime_ns, size, lines).  This only
+# pays off in the long-lived aa_daemon, where one process serves many
+# commands; a standalone command reads each file once anyway.
+_lines_cache = {}
+
+def read_lines (path):
+    st = os.stat(path)
+    cached = _lines_cache.get(path, None)
+    if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return list(cached[2])
+    with open(path, "r") as f:
+        lines = f.readlines()
+    _lines_cache[path] = (st.st_mtime_ns, st.st_size, lines)
+    return list(lines)
+
 def get_arg_merged (name):
     if len(sys.argv) < 2:
         sys.stderr.write(f"usage: {os.path.basename(sys.argv[0])} <{name}>\n")
@@ -106,8 +121,7 @@ class Context:
         self.path = path
         self.lines = []
         self.old_displayed_lines = None
-        with open(path, "r") as f:
-            self.lines = f.readlines()
+        self.lines = read_lines(os.path.abspath(path))
 
     def display_state (self):
         if self.lines:
@@ -195,29 +209,34 @@ class Context:
             self.displayed_lines = None
             return
         self.displayed_lines = lines
-        margin = max(3, len(str(lines[-1]+1)))
-        printed_hits = 0
-        printed_lines = 0
-        last = None
-        for i in lines:
-            if i < 0:
-                continue
-            if i >= len(self.lines):
-                continue
-            if max_lines is not None and printed_lines >= max_lines:
-                break
-            if last is not None and last + 1 < i:
-                sys.stdout.write(' ')
-                sys.stdout.write('.'* margin)
-                sys.stdout.write('|\n')
-            last = i
-            mark = ' '
-            if i in starred:
-                mark = '*'
-                printed_hits += 1
-            sys.stdout.write(f'{mark}{i+1:>{margin}}|{self.lines[i].rstrip()}\n')
-            printed_lines += 1
-        return printed_hits
+        return print_lines(self.lines, lines, starred, max_lines)
+
+def print_lines (file_lines, lines, starred = set(), max_lines = 25):
+    # Prints the given line numbers of file_lines, with a mark on the
+    # starred ones.  Returns the number of starred lines printed.
+    margin = max(3, len(str(lines[-1]+1)))
+    printed_hits = 0
+    printed_lines = 0
+    last = None
+    for i in lines:
+        if i < 0:
+            continue
+        if i >= len(file_lines):
+            continue
+        if max_lines is not None and printed_lines >= max_lines:
+            break
+        if last is not None and last + 1 < i:
+            sys.stdout.write(' ')
+            sys.stdout.write('.'* margin)
+            sys.stdout.write('|\n')
+        last = i
+        mark = ' '
+        if i in starred:
+            mark = '*'
+            printed_hits += 1
+        sys.stdout.write(f'{mark}{i+1:>{margin}}|{file_lines[i].rstrip()}\n')
+        printed_lines += 1
+    return printed_hits
 
 
 @contextmanager
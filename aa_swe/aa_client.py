@@ -0,0 +1,85 @@
+import os
+import sys
+import json
+import socket
+import importlib
+from aa_swe.aa_daemon import COMMANDS, socket_path, recv_all
+
+# Entry points of the aa_* commands.  Each forwards the command to
+# aa_daemon if it is running, and otherwise runs it in this process as
+# before.  Only light modules are imported here, so the client starts fast.
+
+def call_daemon (command, argv):
+    # Returns the exit code, or None if the daemon is not available.
+    path = socket_path()
+    if not os.path.exists(path):
+        return None
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+    except OSError:
+        conn.close()
+        return None
+    with conn:
+        stdin = None
+        if COMMANDS[command]:
+            stdin = sys.stdin.read()
+        request = {
+            'command': command,
+            'argv': argv,
+            'cwd': os.getcwd(),
+            'work_dir': os.getenv('AA_SWE_WORK_DIR', None),
+            'stdin': stdin,
+        }
+        conn.sendall(json.dumps(request).encode('utf-8'))
+        conn.shutdown(socket.SHUT_WR)
+        # Once the request is sent the daemon may have acted on it, so
+        # do not fall back to running the command again.
+        try:
+            response = json.loads(recv_all(conn).decode('utf-8'))
+        except (OSError, ValueError) as e:
+            sys.stderr.write(f"aa_daemon failed: {e}\n")
+            return 1
+    sys.stdout.write(response['stdout'])
+    sys.stderr.write(response['stderr'])
+    return response['code']
+
+def run (command):
+    code = call_daemon(command, sys.argv[1:])
+    if code is None:
+        module = importlib.import_module(f"aa_swe.{command}")
+        code = module.main()
+    return code
+
+def aa_open ():
+    return run('aa_open')
+
+def aa_close ():
+    return run('aa_close')
+
+def aa_list ():
+    return run('aa_list')
+
+def aa_search ():
+    return run('aa_search')
+
+def aa_scroll ():
+    return run('aa_scroll')
+
+def aa_select ():
+    return run('aa_select')
+
+def aa_rewrite ():
+    return run('aa_rewrite')
+
+def aa_create ():
+    return run('aa_create')
+
+def aa_find_def ():
+    return run('aa_find_def')
+
+def aa_find_class ():
+    return run('aa_find_class')
+
+def aa_grep ():
+    return run('aa_grep')
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import os, sys
 from aa_swe.aa import aa_context, get_arg_merged
+from aa_swe.aa_index import refresh_files
 
 def main():
     path = get_arg_merged('path')
@@ -16,6 +17,7 @@ def main():
         with open(path, "w") as f:
             for line in sys.stdin:
                 f.write(line)
+        refresh_files(aa.root, [path])
         sys.stdout.write(f"created file: {path}\n")
 
 if __name__ == "__main__":
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import socket
+import importlib
+import traceback
+from io import StringIO
+from contextlib import redirect_stdout, redirect_stderr
+
+# A long-lived process that runs the aa_* commands in-process.
+#
+# Every aa_* command used to be a separate python process that imports
+# aa_swe, re-reads state.json and re-reads the open file.  The daemon
+# keeps the modules imported and the file lines (aa.read_lines) and the
+# def/class index (aa_index.load_index) cached across commands.  The
+# aa_* entry points (aa_client) forward to the daemon over a Unix socket,
+# and run the command themselves if the daemon is not there.
+#
+# Protocol: the client sends one JSON request
+#     {"command": "aa_open", "argv": [...], "cwd": ..., "work_dir": ..., "stdin": ...}
+# and shuts down its side of the connection; the daemon answers with one
+# JSON response {"stdout": ..., "stderr": ..., "code": ...} and closes.
+
+SOCKET_NAME = 'aa.sock'
+
+# commands the daemon may run, and whether they read stdin
+COMMANDS = {
+    'aa_open': False,
+    'aa_close': False,
+    'aa_list': False,
+    'aa_search': False,
+    'aa_scroll': False,
+    'aa_select': False,
+    'aa_rewrite': True,
+    'aa_create': True,
+    'aa_find_def': False,
+    'aa_find_class': False,
+    'aa_grep': False,
+}
+
+def socket_path ():
+    path = os.getenv('AA_SWE_DAEMON_SOCKET', None)
+    if path is None:
+        path = os.path.join(os.getenv('AA_SWE_WORK_DIR', './'), SOCKET_NAME)
+    return path
+
+def recv_all (conn):
+    chunks = []
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+def run_command (request):
+    command = request['command']
+    if command not in COMMANDS:
+        return {'stdout': '', 'stderr': f"unknown command: {command}\n", 'code': 1}
+    module = importlib.import_module(f"aa_swe.{command}")
+    out = StringIO()
+    err = StringIO()
+    saved_argv = sys.argv
+    saved_stdin = sys.stdin
+    sys.argv = [command] + request.get('argv', [])
+    sys.stdin = StringIO(request.get('stdin', None) or '')
+    if request.get('work_dir', None) is not None:
+        os.environ['AA_SWE_WORK_DIR'] = request['work_dir']
+    code = 0
+    try:
+        os.chdir(request.get('cwd', '/testbed'))
+        with redirect_stdout(out), redirect_stderr(err):
+            try:
+                code = module.main()
+            except SystemExit as e:
+                code = e.code
+            except Exception:
+                traceback.print_exc()
+                code = 1
+    except OSError as e:
+        err.write(f"{e}\n")
+        code = 1
+    finally:
+        sys.argv = saved_argv
+        sys.stdin = saved_stdin
+    if code is not None and not isinstance(code, int):
+        err.write(f"{code}\n")
+        code = 1
+    return {'stdout': out.getvalue(), 'stderr': err.getvalue(), 'code': code or 0}
+
+def serve (path):
+    if os.path.exists(path):
+        os.remove(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(16)
+    # commands are run one at a time; the agent issues them one at a time
+    while True:
+        conn, _ = server.accept()
+        with conn:
+            try:
+                request = json.loads(recv_all(conn).decode('utf-8'))
+                response = run_command(request)
+            except Exception:
+                response = {'stdout': '', 'stderr': traceback.format_exc(), 'code': 1}
+            try:
+                conn.sendall(json.dumps(response).encode('utf-8'))
+            except OSError:
+                pass
+
+def main ():
+    path = socket_path()
+    sys.stderr.write(f"aa_daemon listening on {path}\n")
+    serve(path)
+
+if __name__ == "__main__":
+    main()
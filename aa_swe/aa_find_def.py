@@ -1,21 +1,54 @@
-import os
 import sys
-import pickle
-from aa_swe.aa import aa_context, get_arg_merged
+from aa_swe.aa import aa_context
+from aa_swe.aa_symbols import open_symbols
+from aa_swe.aa_index import merge_pending
+
+MAX_HITS = 20
+
+def usage (kind):
+    sys.stderr.write(f"usage: aa_find_{kind} [-i] <name>\n")
+    sys.stderr.write(f"  name can be qualified by the class, e.g. Class.method\n")
+    sys.stderr.write(f"  name*: find all {kind}s whose name starts with name\n")
+    sys.stderr.write(f"  -i: ignore case\n")
+    sys.exit(1)
 
 def find_def_or_class (kind):
-    name = get_arg_merged("name")
+    args = sys.argv[1:]
+    ignore_case = False
+    if len(args) > 0 and args[0] == '-i':
+        ignore_case = True
+        args = args[1:]
+    if len(args) == 0:
+        usage(kind)
+    name = ' '.join(args)
+    prefix = name.endswith('*')
+    if prefix:
+        name = name[:-1]
     with aa_context() as aa:
-        index = pickle.load(open(os.path.join(aa.root, "index.pkl"), "rb"))
-        hits = index[kind].get(name, [])
+        merge_pending(aa.root)
+        symbols = open_symbols(aa.root)
+        if symbols is None:
+            sys.stderr.write(f"The index is not available; try using grep.\n")
+            return
+        hits = symbols.lookup(kind, name, prefix=prefix, ignore_case=ignore_case)
+        if len(hits) == 0 and not ignore_case:
+            hits = symbols.lookup(kind, name, prefix=prefix, ignore_case=True)
+            if len(hits) > 0:
+                sys.stdout.write(f"Nothing found for {kind} {name} with this case; showing case-insensitive matches.\n")
+        symbols.close()
         if len(hits) == 0:
             sys.stderr.write(f"Nothing found for {kind} {name}; try using grep.\n")
             return
-        for path, begin, end in hits:
-            print(path)
+        for qualname, path, head, begin, end in hits[:MAX_HITS]:
+            if end is None:
+                print(f"{path}: {qualname}")
+            else:
+                print(f"{path}: {qualname}, lines {head+1}-{end}")
             aa.set_path(path)
-            aa.display_lines(list(range(begin, begin+1)))
+            aa.display_lines(list(range(head, begin+1)))
+        if len(hits) > MAX_HITS:
+            sys.stdout.write(f"{len(hits) - MAX_HITS} more not displayed; be more specific.\n")
         aa.set_path(None)
 
 def main ():
-    find_def_or_class('def')
\ No newline at end of file
+    find_def_or_class('def')
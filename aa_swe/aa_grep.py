@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+import os
+import sys
+import re
+from collections import defaultdict
+from aa_swe.aa import aa_context, get_arg_merged, read_lines, print_lines
+from aa_swe.aa_trigrams import open_trigrams, required_literals, read_dirty
+
+# Searches the whole repo with a regex, like grep -r, but only scans the
+# files the trigram index says can match (see aa_trigrams).
+
+RADIUS = 1
+MAX_LINES_PER_FILE = 15
+MAX_FILES = 20
+
+def search_file (regex, lines):
+    # Returns the lines to display and the hits, as aa_search does.
+    to_print = defaultdict(list)
+    hits = 0
+    for i, line in enumerate(lines):
+        if regex.search(line):
+            hits += 1
+            to_print[i].append(2)
+            for j in range(i-RADIUS, i+RADIUS+1):
+                to_print[j].append(1)
+    display = []
+    starred = set()
+    for i, levels in to_print.items():
+        if i < 0 or i >= len(lines):
+            continue
+        display.append(i)
+        if max(levels) >= 2:
+            starred.add(i)
+    display.sort()
+    return display, starred, hits
+
+def main ():
+    pattern = get_arg_merged('pattern')
+    try:
+        regex = re.compile(pattern)
+    except Exception as e:
+        sys.stderr.write(f"Error compiling regex: {e}\n")
+        return 1
+
+    with aa_context() as aa:
+        index = open_trigrams(aa.root)
+        if index is None:
+            sys.stderr.write("The search index is not available; use grep -r.\n")
+            return 1
+        top = index.top
+        candidates = index.candidates(required_literals(pattern))
+        if candidates is None:
+            candidates = range(index.n_files)
+        paths = {os.path.normpath(os.path.join(top, index.file(i)[0])) for i in candidates}
+        index.close()
+        # files modified since the index was built
+        paths.update(read_dirty(aa.root))
+
+        files_with_hits = 0
+        total_hits = 0
+        for path in sorted(paths):
+            try:
+                lines = read_lines(path)
+            except (OSError, UnicodeDecodeError):
+                continue
+            display, starred, hits = search_file(regex, lines)
+            if hits == 0:
+                continue
+            files_with_hits += 1
+            total_hits += hits
+            if files_with_hits > MAX_FILES:
+                continue
+            key = os.path.join('.', os.path.relpath(path, top))
+            sys.stdout.write(f"{key}: {hits} matches\n")
+            # printed directly: the file open in the session stays open
+            printed_hits = print_lines(lines, display, starred, MAX_LINES_PER_FILE)
+            if printed_hits < hits:
+                sys.stdout.write(f"  ... {hits - printed_hits} more matches, use aa_open and aa_search.\n")
+            sys.stdout.write('\n')
+        if files_with_hits == 0:
+            sys.stdout.write("no matches found\n")
+            return 0
+        if files_with_hits > MAX_FILES:
+            sys.stdout.write(f"Found {total_hits} matches in {files_with_hits} files, first {MAX_FILES} files displayed.  Use a more specific pattern.\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+import os
+import ast
+import pickle
+import hashlib
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from aa_swe.aa_symbols import SYMBOLS_NAME, write_symbols
+from aa_swe.aa_trigrams import mark_dirty
+
+# The def/class index of the source code.
+#
+# index = {
+#     'version': INDEX_VERSION,
+#     'top': the directory indexed, normally /testbed,
+#     'files': {path: {'mtime', 'size', 'hash', 'def': [...], 'class': [...]}},
+#     'def': {name: [(path, head, begin, end, qualified name), ...]},
+#     'class': {name: [(path, head, begin, end, qualified name), ...]},
+# }
+#
+# Paths are relative to top and start with './'.  The per-file entries
+# allow the index to be updated incrementally: only files whose
+# mtime/size changed and whose content hash differs are parsed again.
+# 'def' and 'class' are derived from 'files'.
+#
+# Every time the index is written, the compact lookup table used by
+# aa_find_def (see aa_symbols) is written next to it.  Files modified by
+# aa_rewrite/aa_create are not re-parsed right away but listed in
+# index.pending, and merged before the next aa_find_def/aa_find_class.
+
+INDEX_NAME = 'index.pkl'
+PENDING_NAME = 'index.pending'      # files modified since the last lookup
+INDEX_VERSION = 2
+BAKED_INDEX = '/meta/index.pkl'     # built with the image by swe_build_docker
+PARALLEL_MIN_FILES = 200            # below this a process pool doesn't pay off
+SHARDS_PER_JOB = 4
+
+def collect_defs (node, scope, defs, classes):
+    # scope: names of the enclosing classes; None inside a function, where
+    # names are not qualified.
+    for child in ast.iter_child_nodes(node):
+        if isinstance(child, ast.expr):
+            # expressions never contain def statements
+            continue
+        if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            qualname = '.'.join(scope + [child.name]) if scope else child.name
+            # head: the first decorator line
+            head = min([d.lineno for d in child.decorator_list] + [child.lineno]) - 1
+            record = (child.name, qualname, head, child.lineno - 1, child.end_lineno)
+            if isinstance(child, ast.ClassDef):
+                classes.append(record)
+                collect_defs(child, (scope or []) + [child.name], defs, classes)
+            else:
+                defs.append(record)
+                collect_defs(child, None, defs, classes)
+        else:
+            collect_defs(child, scope, defs, classes)
+
+def parse_source (path, file_content):
+    # Returns the defs and classes of the file as lists of
+    # (name, qualified name, head, begin, end).  begin is the 0-based line
+    # of the def/class statement, head that of its first decorator, and
+    # end the 0-based exclusive end of the body.  Methods are qualified by
+    # their classes, e.g. Class.method.
+    defs = []
+    classes = []
+    try:
+        tree = ast.parse(file_content, filename=path)
+        collect_defs(tree, [], defs, classes)
+    except:
+        lines = file_content.split('\n')
+        for i, line in enumerate(lines):
+            off = line.find('def ')
+            if off != -1:
+                def_name = line[off+4:].split('(')[0].strip()
+                defs.append((def_name, def_name, i, i, None))
+            off = line.find('class ')
+            if off != -1:
+                rest = line[off+6:]
+                offset1 = rest.find('(')
+                offset2 = rest.find(':')
+                if offset1 < 0:
+                    offset = offset2
+                elif offset2 < 0:
+                    offset = offset1
+                else:
+                    offset = min(offset1, offset2)
+                if offset >= 0:
+                    class_name = rest[:offset].strip()
+                    classes.append((class_name, class_name, i, i, None))
+    return defs, classes
+
+def index_file (full_path, key):
+    st = os.stat(full_path)
+    with open(full_path, 'rb') as f:
+        content = f.read()
+    entry = {
+        'mtime': st.st_mtime_ns,
+        'size': st.st_size,
+        'hash': hashlib.sha1(content).hexdigest(),
+    }
+    entry['def'], entry['class'] = parse_source(key, content.decode('utf-8', errors='replace'))
+    return entry
+
+def list_source_files (top):
+    # Returns the index keys of all python files under top, in os.walk order.
+    keys = []
+    for root, _, files in os.walk(top):
+        for file in files:
+            if file.endswith('.py'):
+                keys.append(os.path.join('.', os.path.relpath(os.path.join(root, file), top)))
+    return keys
+
+def merge_files (index):
+    # Each def/class is listed under its name and, for methods and nested
+    # classes, also under its qualified name.
+    def_index = defaultdict(list)
+    class_index = defaultdict(list)
+    for key, entry in index['files'].items():
+        for kind_index, records in [(def_index, entry['def']), (class_index, entry['class'])]:
+            for name, qualname, head, begin, end in records:
+                hit = (key, head, begin, end, qualname)
+                kind_index[name].append(hit)
+                if qualname != name:
+                    kind_index[qualname].append(hit)
+    index['def'] = def_index
+    index['class'] = class_index
+    return index
+
+def index_files (top, keys):
+    # Indexes a shard of files; runs in the worker processes of build_index.
+    entries = []
+    for key in keys:
+        try:
+            entries.append((key, index_file(os.path.join(top, key), key)))
+        except OSError:
+            continue
+    return entries
+
+def build_index (top='.', jobs=None):
+    # jobs: number of processes to parse with; None to use all cores when
+    # the tree is large enough.  The result is identical to the serial
+    # build: shards are contiguous runs of the os.walk order and are
+    # merged back in that order.
+    top = os.path.abspath(top)
+    keys = list_source_files(top)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+        if len(keys) < PARALLEL_MIN_FILES:
+            jobs = 1
+    files = {}
+    if jobs <= 1:
+        for key, entry in index_files(top, keys):
+            files[key] = entry
+    else:
+        n_shards = jobs * SHARDS_PER_JOB
+        shard_size = (len(keys) + n_shards - 1) // n_shards
+        shards = [keys[i:i+shard_size] for i in range(0, len(keys), shard_size)]
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for entries in executor.map(index_files, [top] * len(shards), shards):
+                for key, entry in entries:
+                    files[key] = entry
+    return merge_files({'version': INDEX_VERSION, 'top': top, 'files': files})
+
+def update_index (index, keys=None):
+    # Re-parse files that changed since they were indexed.  keys: the
+    # files to check; None to check the whole tree, which also picks up
+    # new and deleted files.  Returns the number of files re-parsed or
+    # removed.
+    top = index['top']
+    files = index['files']
+    changed = 0
+    if keys is None:
+        keys = list_source_files(top)
+        present = set(keys)
+        for key in list(files.keys()):
+            if key not in present:
+                del files[key]
+                changed += 1
+    for key in keys:
+        full_path = os.path.join(top, key)
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            if key in files:
+                del files[key]
+                changed += 1
+            continue
+        entry = files.get(key, None)
+        if entry is not None and entry['mtime'] == st.st_mtime_ns and entry['size'] == st.st_size:
+            continue
+        new_entry = index_file(full_path, key)
+        if entry is not None and entry['hash'] == new_entry['hash']:
+            # touched but not modified, e.g. copied into the image
+            entry['mtime'] = new_entry['mtime']
+            continue
+        files[key] = new_entry
+        changed += 1
+    if changed > 0:
+        merge_files(index)
+    return changed
+
+def index_key (index, path):
+    # The index key of a path as given by the user, or None if the path
+    # is not an indexed python file under top.
+    if not path.endswith('.py'):
+        return None
+    rel = os.path.relpath(os.path.abspath(path), index['top'])
+    if rel.startswith('..'):
+        return None
+    return os.path.join('.', rel)
+
+_index_cache = {}   # path -> (mtime_ns, index), for aa_daemon
+
+def load_index (root):
+    # The index of the session in state directory root, or None.
+    path = os.path.join(root, INDEX_NAME)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = _index_cache.get(path, None)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    index = read_index(path)
+    _index_cache[path] = (mtime, index)
+    return index
+
+def read_index (path):
+    with open(path, 'rb') as f:
+        index = pickle.load(f)
+    if index.get('version', None) != INDEX_VERSION:
+        # older format without per-file entries; can only be rebuilt
+        return None
+    return index
+
+def save_index (root, index):
+    path = os.path.join(root, INDEX_NAME)
+    write_index(path, index)
+    _index_cache[path] = (os.stat(path).st_mtime_ns, index)
+
+def write_index (path, index):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(index, f)
+    os.replace(tmp_path, path)
+    write_symbols(os.path.join(os.path.dirname(path), SYMBOLS_NAME), index)
+
+def refresh_files (root, paths):
+    # Called after aa_* commands modify files.  Editing has to stay cheap,
+    # so the files are only listed as pending, and merged into the index
+    # by merge_pending at the next lookup.  The trigram index of aa_grep
+    # is not rebuilt either; the files are listed as dirty there.
+    mark_dirty(root, paths)
+    with open(os.path.join(root, PENDING_NAME), 'a') as f:
+        for path in paths:
+            f.write(os.path.abspath(path) + '\n')
+
+def merge_pending (root):
+    # Re-parses the files modified since the last lookup, if any, and
+    # saves the index.  Returns the number of files re-parsed or removed.
+    path = os.path.join(root, PENDING_NAME)
+    merging_path = path + '.merging'
+    paths = set()
+    if os.path.exists(merging_path):
+        # left over by a lookup that was interrupted
+        paths.update(read_paths(merging_path))
+    elif not os.path.exists(path):
+        return 0
+    if os.path.exists(path):
+        # files listed from now on go to a new list
+        os.replace(path, merging_path)
+        paths.update(read_paths(merging_path))
+    index = load_index(root)
+    changed = 0
+    if index is not None:
+        keys = [key for key in (index_key(index, path) for path in paths) if key is not None]
+        if len(keys) > 0:
+            changed = update_index(index, keys)
+        if changed > 0:
+            save_index(root, index)
+    os.remove(merging_path)
+    return changed
+
+def read_paths (path):
+    with open(path, 'r') as f:
+        return [line.rstrip('\n') for line in f if line.strip()]
+
+def reset_pending (root):
+    # After a full update of the index.
+    for name in [PENDING_NAME, PENDING_NAME + '.merging']:
+        path = os.path.join(root, name)
+        if os.path.exists(path):
+            os.remove(path)
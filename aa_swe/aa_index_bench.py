@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+import os
+import time
+import shutil
+import argparse
+import tempfile
+from aa_swe.aa_index import build_index
+
+# Compares the serial and the parallel build of the def/class index on a
+# synthetic source tree, and checks that both give the same index.
+#
+#     python3 -m aa_swe.aa_index_bench --files 5000 -j 8
+
+def make_tree (top, n_files, n_classes, n_methods, files_per_dir=50):
+    for i in range(n_files):
+        dir_ = os.path.join(top, f"pkg{i // files_per_dir}")
+        os.makedirs(dir_, exist_ok=True)
+        with open(os.path.join(dir_, f"mod{i}.py"), 'w') as f:
+            f.write("import os\nimport sys\n\n")
+            for c in range(n_classes):
+                f.write(f"class Class{i}_{c}(object):\n")
+                f.write(f"    \"\"\"Docstring of class {c}.\"\"\"\n\n")
+                for m in range(n_methods):
+                    f.write(f"    def method{m}(self, x, y=None):\n")
+                    f.write(f"        if x > {m}:\n")
+                    f.write(f"            return [v * {m} for v in range(x)]\n")
+                    f.write(f"        return dict(a=x, b=y)\n\n")
+            f.write(f"def function{i}(*args, **kwargs):\n    return len(args) + len(kwargs)\n")
+
+def timed (fn):
+    begin = time.time()
+    result = fn()
+    return result, time.time() - begin
+
+def main ():
+    parser = argparse.ArgumentParser(description='Benchmark the serial and parallel index builds.')
+    parser.add_argument('--files', type=int, default=2000, help='Number of source files')
+    parser.add_argument('--classes', type=int, default=5, help='Classes per file')
+    parser.add_argument('--methods', type=int, default=10, help='Methods per class')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='Processes for the parallel build')
+    parser.add_argument('--dir', default=None, help='Where to create the tree (default: a temporary directory)')
+    args = parser.parse_args()
+
+    top = args.dir or tempfile.mkdtemp(prefix='aa_index_bench.')
+    try:
+        make_tree(top, args.files, args.classes, args.methods)
+        serial, serial_time = timed(lambda: build_index(top, jobs=1))
+        parallel, parallel_time = timed(lambda: build_index(top, jobs=args.jobs))
+        identical = (list(serial['files'].items()) == list(parallel['files'].items())
+                     and list(serial['def'].items()) == list(parallel['def'].items())
+                     and list(serial['class'].items()) == list(parallel['class'].items()))
+        print(f"files: {len(serial['files'])}, defs: {sum(len(v) for v in serial['def'].values())}, classes: {sum(len(v) for v in serial['class'].values())}")
+        print(f"serial:      {serial_time:.3f}s")
+        print(f"parallel({args.jobs}): {parallel_time:.3f}s ({serial_time / parallel_time:.2f}x)")
+        print(f"identical:   {identical}")
+        if not identical:
+            return 1
+    finally:
+        if args.dir is None:
+            shutil.rmtree(top, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
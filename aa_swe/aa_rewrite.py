@@ -2,6 +2,7 @@
 import sys
 from pyflakes.api import check as pyflakes_check
 from aa_swe.aa import aa_context, Reporter
+from aa_swe.aa_index import refresh_files
 
 def main ():
     with aa_context() as aa:
@@ -31,6 +32,7 @@ def main ():
         if not result:
             with open(aa.path, "w") as f:
                 f.write(new_content) 
+            refresh_files(aa.root, [aa.path])
             aa.set_path(aa.path)
             sys.stdout.write(f"{end-begin} lines rewritten, new content:\n")
             lines= []
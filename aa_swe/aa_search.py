@@ -12,7 +12,7 @@ def main():
         max_lines = 25
         if not aa.lines:
             sys.stderr.write(f"Please aa_open a file before aa_search.\n")
-            sys.stderr.write(f"In you want to search a directory, use the grep -r of Linux.\n")
+            sys.stderr.write(f"In you want to search the whole repo, use aa_grep.\n")
             return 1
         try:
             regex = re.compile(pattern)
@@ -0,0 +1,180 @@
+import os
+import mmap
+import struct
+
+# Compact on-disk form of the def/class index, for lookups.
+#
+# aa_find_def used to unpickle the whole index to look up one name.  This
+# file is memory-mapped instead and searched with binary search, so a
+# lookup only touches the entries it visits and the records of the
+# matches, independent of the size of the repo.
+#
+# Layout (little endian):
+#
+#     header      MAGIC, n_files, n_entries, n_records, files blob size, names blob size
+#     file table  (n_files + 1) uint32 offsets into the files blob
+#     files blob  utf-8 paths
+#     entries     n_entries x (name offset, name length, kind, record begin, record count)
+#                 sorted by (name.lower(), name, kind)
+#     names blob  utf-8 names
+#     records     n_records x (file id, head, begin, end, qualified name offset,
+#                 qualified name length); end NO_END for None.  The
+#                 qualified name is always also an entry name, so it
+#                 points into the names blob.
+#
+# Sorting by the lower-cased name first makes exact, prefix and
+# case-insensitive lookups all a binary search followed by a short scan.
+
+SYMBOLS_NAME = 'index.sym'
+MAGIC = b'AASYM002'
+HEADER = struct.Struct('<8sIIIII4x')
+OFFSET = struct.Struct('<I')
+ENTRY = struct.Struct('<IHBxII')
+RECORD = struct.Struct('<IIIIIH2x')
+NO_END = 0xFFFFFFFF
+KINDS = ['def', 'class']
+
+def write_symbols (path, index):
+    file_ids = {}
+    for key in index['files']:
+        file_ids[key] = len(file_ids)
+    entries = []
+    for kind_id, kind in enumerate(KINDS):
+        for name, hits in index[kind].items():
+            if len(hits) > 0:
+                entries.append((name.lower(), name, kind_id, hits))
+    entries.sort(key=lambda e: (e[0], e[1], e[2]))
+
+    files_blob = bytearray()
+    file_table = bytearray()
+    for key in file_ids:
+        file_table += OFFSET.pack(len(files_blob))
+        files_blob += key.encode('utf-8')
+    file_table += OFFSET.pack(len(files_blob))
+
+    names_blob = bytearray()
+    name_offsets = {}
+    for _, name, _, _ in entries:
+        if name not in name_offsets:
+            encoded = name.encode('utf-8')
+            name_offsets[name] = (len(names_blob), len(encoded))
+            names_blob += encoded
+    entry_table = bytearray()
+    records = bytearray()
+    n_records = 0
+    for _, name, kind_id, hits in entries:
+        name_off, name_len = name_offsets[name]
+        entry_table += ENTRY.pack(name_off, name_len, kind_id, n_records, len(hits))
+        for key, head, begin, end, qualname in hits:
+            qual_off, qual_len = name_offsets.get(qualname, (name_off, name_len))
+            records += RECORD.pack(file_ids[key], head, begin, NO_END if end is None else end, qual_off, qual_len)
+            n_records += 1
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(file_ids), len(entries), n_records, len(files_blob), len(names_blob)))
+        f.write(file_table)
+        f.write(files_blob)
+        f.write(entry_table)
+        f.write(names_blob)
+        f.write(records)
+    os.replace(tmp_path, path)
+
+class SymbolIndex:
+    def __init__ (self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n_files, self.n_entries, self.n_records, files_size, names_size = HEADER.unpack_from(self.data, 0)
+        assert magic == MAGIC, f"{path} is not a symbol index"
+        self.file_table = HEADER.size
+        self.files_blob = self.file_table + (self.n_files + 1) * OFFSET.size
+        self.entries = self.files_blob + files_size
+        self.names_blob = self.entries + self.n_entries * ENTRY.size
+        self.records = self.names_blob + names_size
+
+    def close (self):
+        self.data.close()
+
+    def file_path (self, file_id):
+        begin, = OFFSET.unpack_from(self.data, self.file_table + file_id * OFFSET.size)
+        end, = OFFSET.unpack_from(self.data, self.file_table + (file_id + 1) * OFFSET.size)
+        return self.data[self.files_blob + begin:self.files_blob + end].decode('utf-8')
+
+    def entry (self, i):
+        name_off, name_len, kind_id, rec_begin, rec_count = ENTRY.unpack_from(self.data, self.entries + i * ENTRY.size)
+        return self.name_at(name_off, name_len), kind_id, rec_begin, rec_count
+
+    def first_at_least (self, key):
+        # The first entry whose lower-cased name is >= key.
+        lo, hi = 0, self.n_entries
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.entry(mid)[0].lower() < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def name_at (self, off, length):
+        return self.data[self.names_blob + off:self.names_blob + off + length].decode('utf-8')
+
+    def lookup (self, kind, name, prefix=False, ignore_case=False):
+        # Returns [(qualified name, path, head, begin, end)] for defs or
+        # classes named name, or whose name starts with name if prefix.
+        # name can be qualified, e.g. Class.method, also partly, e.g.
+        # Inner.method for Outer.Inner.method.
+        kind_id = KINDS.index(kind)
+        hits = []
+        seen = set()    # a method can match both by name and by qualified name
+        self.scan(kind_id, name, prefix, ignore_case, hits, seen)
+        if '.' in name:
+            # partly qualified: the entries of the last part whose
+            # qualified name ends with name
+            self.scan(kind_id, name.rpartition('.')[2], prefix, ignore_case, hits, seen,
+                      accept=lambda qualname: matches_tail(qualname, name, prefix, ignore_case))
+        return hits
+
+    def scan (self, kind_id, name, prefix, ignore_case, hits, seen, accept=None):
+        key = name.lower()
+        for i in range(self.first_at_least(key), self.n_entries):
+            entry_name, entry_kind, rec_begin, rec_count = self.entry(i)
+            lowered = entry_name.lower()
+            if prefix:
+                if not lowered.startswith(key):
+                    break
+            elif lowered != key:
+                break
+            if entry_kind != kind_id:
+                continue
+            if not ignore_case:
+                if prefix and not entry_name.startswith(name):
+                    continue
+                if not prefix and entry_name != name:
+                    continue
+            for r in range(rec_begin, rec_begin + rec_count):
+                file_id, head, begin, end, qual_off, qual_len = RECORD.unpack_from(self.data, self.records + r * RECORD.size)
+                if (file_id, begin) in seen:
+                    continue
+                qualname = self.name_at(qual_off, qual_len)
+                if accept is not None and not accept(qualname):
+                    continue
+                seen.add((file_id, begin))
+                hits.append((qualname, self.file_path(file_id), head, begin, None if end == NO_END else end))
+
+def matches_tail (qualname, name, prefix, ignore_case):
+    # Whether a dotted suffix of qualname is name (or starts with it).
+    if ignore_case:
+        qualname = qualname.lower()
+        name = name.lower()
+    parts = qualname.split('.')
+    for i in range(1, len(parts)):
+        tail = '.'.join(parts[i:])
+        if tail.startswith(name) if prefix else tail == name:
+            return True
+    return False
+
+def open_symbols (root):
+    path = os.path.join(root, SYMBOLS_NAME)
+    if not os.path.exists(path):
+        return None
+    return SymbolIndex(path)
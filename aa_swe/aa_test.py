@@ -1,11 +1,251 @@
 #!/usr/bin/env python3
 import os
+import re
+import sys
+import json
+import shlex
+import signal
+import random
+import argparse
 import subprocess as sp
+from aa_swe.aa_testlog import TestLogScanner, ABORTED_TEST_OUTPUT, FAILED, ERROR
+
+# aa_test runs the eval script of the instance, i.e. all tests the
+# grader runs.  aa_test --fast runs only the FAIL_TO_PASS tests and a
+# selection of the PASS_TO_PASS tests: those that look related to the
+# files changed by the current git diff, plus a small random sample.
+# The selection is written to fast_tests.json in the work directory, so
+# the host grades the fast run on the selected tests only.  Only the full
+# run can produce the patch.
+#
+# With --abort-early the output of the test run is watched as it is
+# produced, and the run is killed as soon as a FAIL_TO_PASS test fails or
+# pytest cannot collect one of the test modules of the instance (e.g. an
+# import error in the code under test); the run cannot pass any more.
+# The tests are recognized when the runner names them as they finish
+# (django, sympy, pytest -v); with pytest -rA the names come only at the
+# end, so there only collection errors abort the run.
+
+EVAL_SCRIPT = '/meta/patched_eval.sh'
+INSTANCE_PATH = '/meta/instance.json'
+FAST_TESTS_NAME = 'fast_tests.json'
+FAST_SCRIPT_NAME = 'fast_eval.sh'
+START_MARKER = '>>>>> Start Test Output'
+MAX_IMPACTED = 50
+DEFAULT_SAMPLE = 10
+
+def load_tests (instance, key):
+    tests = instance.get(key, [])
+    if isinstance(tests, str):
+        tests = json.loads(tests)
+    return tests
+
+def changed_files ():
+    # The test patch is committed in the testbed, so the diff to HEAD is
+    # the agent's change.
+    out = sp.run("git diff --name-only HEAD", shell=True, capture_output=True, cwd='/testbed').stdout.decode('utf-8')
+    return [line.strip() for line in out.splitlines() if line.strip()]
+
+def impact_keywords (paths):
+    keywords = set()
+    for path in paths:
+        if not path.endswith('.py'):
+            continue
+        parts = path[:-3].split('/')
+        stem = parts[-1]
+        if stem == '__init__' and len(parts) > 1:
+            stem = parts[-2]
+        keywords.add(stem)
+    return keywords
+
+def select_pass_to_pass (tests, keywords, sample, seed):
+    # Tests whose name mentions a changed module, e.g. test_query.py or
+    # queries.tests for query.py, then a random sample of the others.
+    impacted = []
+    others = []
+    for test in tests:
+        tokens = set(re.split(r'[^A-Za-z0-9_]+', test))
+        hit = False
+        for keyword in keywords:
+            if keyword in tokens or f"test_{keyword}" in tokens or f"{keyword}s" in tokens:
+                hit = True
+                break
+        if hit and len(impacted) < MAX_IMPACTED:
+            impacted.append(test)
+        else:
+            others.append(test)
+    sampled = set(random.Random(seed).sample(others, min(sample, len(others))))
+    return impacted + [test for test in others if test in sampled]
+
+def find_test_command (script):
+    # Returns the index of the line that runs the tests, the one following
+    # the start marker.
+    lines = script.split('\n')
+    for i, line in enumerate(lines):
+        if START_MARKER in line and i + 1 < len(lines):
+            return lines, i + 1
+    return lines, None
+
+def is_directive (word):
+    # not an option, nor the value of one like "--parallel 1" or
+    # "-p no:cacheprovider"
+    if word.startswith('-') or word.isdigit():
+        return False
+    return not (':' in word and '::' not in word)
+
+def split_directives (words):
+    # The test directives are the trailing arguments.
+    n = len(words)
+    while n > 1 and is_directive(words[n-1]):
+        n -= 1
+    return words[:n], words[n:]
+
+def django_label (test):
+    # "test_name (module.tests.Class)" -> "module.tests.Class.test_name"
+    m = re.match(r'^(\w+) \(([\w.]+)\)', test)
+    if m is None:
+        return None
+    name, qualname = m.groups()
+    if qualname.endswith('.' + name):
+        return qualname
+    return f"{qualname}.{name}"
+
+def fast_command (command, tests):
+    # Returns the test command restricted to tests, or None if the tests
+    # cannot be passed to the test runner, in which case the original
+    # directives are kept.
+    words = shlex.split(command)
+    if any(word.endswith('bin/test') for word in words):
+        # sympy's runner selects tests by file; the directives are the
+        # test files of the test patch already
+        return None
+    head, directives = split_directives(words)
+    if len(directives) == 0:
+        return None
+    if any(word.endswith('runtests.py') for word in words):
+        labels = [django_label(test) for test in tests]
+        if None in labels:
+            return None
+    else:
+        labels = set(label for label in map(pytest_label, tests) if label is not None)
+        # a whole file runs its tests already
+        labels = [label for label in labels if '::' not in label or label.split('::')[0] not in labels]
+        if len(labels) == 0:
+            return None
+    return ' '.join(shlex.quote(word) for word in head + sorted(set(labels)))
+
+def pytest_label (test):
+    # The node id to run test with, or its file if the id may not resolve
+    # (pytest runs nothing if one id is not found), or None if the file
+    # does not exist.
+    path, _, rest = test.partition('::')
+    full_path = os.path.join('/testbed', path)
+    if not os.path.isfile(full_path):
+        return None
+    if rest == '':
+        return path
+    # SWE-bench cuts parametrized ids at spaces
+    if any(c.isspace() for c in rest) or rest.count('[') != rest.count(']'):
+        return path
+    with open(full_path, 'r', errors='replace') as f:
+        source = f.read()
+    for name in rest.split('[')[0].split('::'):
+        if re.search(rf'\b(def|class)\s+{re.escape(name)}\b', source) is None:
+            # e.g. inherited or generated tests
+            return path
+    return test
+
+def prepare_fast (work_dir, sample):
+    # Writes the fast eval script and the selected tests, and returns the
+    # path of the script.
+    with open(INSTANCE_PATH, 'r') as f:
+        instance = json.load(f)
+    fail_to_pass = load_tests(instance, 'FAIL_TO_PASS')
+    pass_to_pass = load_tests(instance, 'PASS_TO_PASS')
+    changed = changed_files()
+    selected = select_pass_to_pass(pass_to_pass, impact_keywords(changed), sample, instance['instance_id'])
+
+    with open(EVAL_SCRIPT, 'r') as f:
+        script = f.read()
+    lines, test_line = find_test_command(script)
+    command = None
+    if test_line is not None:
+        command = fast_command(lines[test_line], fail_to_pass + selected)
+    if command is not None:
+        lines[test_line] = command
+    script_path = os.path.join(work_dir, FAST_SCRIPT_NAME)
+    with open(script_path, 'w') as f:
+        f.write('\n'.join(lines))
+    os.chmod(script_path, 0o755)
+    # last, so the host finds the selection only if the run is prepared
+    tests_path = os.path.join(work_dir, FAST_TESTS_NAME)
+    with open(tests_path + '.tmp', 'w') as f:
+        json.dump({
+            'FAIL_TO_PASS': fail_to_pass,
+            'PASS_TO_PASS': selected,
+            'changed': changed,
+            'command': command,
+        }, f, indent=2)
+    os.replace(tests_path + '.tmp', tests_path)
+    sys.stdout.write(f"aa_test --fast: {len(fail_to_pass)} FAIL_TO_PASS and {len(selected)} of {len(pass_to_pass)} PASS_TO_PASS tests selected\n")
+    if command is None:
+        sys.stdout.write("aa_test --fast: running the test files of the full run\n")
+    sys.stdout.flush()
+    return script_path
+
+def run_abort_early (script_path, fail_to_pass, tests):
+    # tests: all the tests of the instance, whose files must be collected
+    targets = set(fail_to_pass)
+    reason = []
+    def on_status (name, status):
+        if status in (FAILED, ERROR) and name in targets and len(reason) == 0:
+            reason.append(f"FAIL_TO_PASS test failed: {name}")
+    modules = set(test.split('::')[0] for test in tests if '::' in test)
+    scanner = TestLogScanner(on_status, modules or None)
+    env = dict(os.environ, PYTHONUNBUFFERED='1')
+    # a new session, so the whole process group can be killed
+    proc = sp.Popen([script_path], stdout=sp.PIPE, stderr=sp.STDOUT, env=env, start_new_session=True)
+    for raw in proc.stdout:
+        line = raw.decode('utf-8', errors='replace')
+        sys.stdout.write(line)
+        scanner.feed(line)
+        if len(reason) == 0 and scanner.collect_error is not None:
+            reason.append(f"collection error: {scanner.collect_error.strip()}")
+        if len(reason) > 0:
+            os.killpg(proc.pid, signal.SIGKILL)
+            break
+    proc.wait()
+    if len(reason) > 0:
+        sys.stdout.write(f"\n{ABORTED_TEST_OUTPUT}: {reason[0]}\n")
+    sys.stdout.flush()
 
 def main ():
+    work_dir = os.getenv('AA_SWE_WORK_DIR', '/output')
+    if '--fast' in sys.argv[1:]:
+        # the selection of an earlier run must not grade this one, even if
+        # this one fails before selecting
+        tests_path = os.path.join(work_dir, FAST_TESTS_NAME)
+        if os.path.exists(tests_path):
+            os.remove(tests_path)
+    parser = argparse.ArgumentParser(description='Run the tests of the instance.')
+    parser.add_argument('--fast', action='store_true', help='Run only the relevant tests')
+    parser.add_argument('--sample', type=int, default=DEFAULT_SAMPLE, help='Unrelated PASS_TO_PASS tests to sample with --fast')
+    parser.add_argument('--abort-early', action='store_true', help='Stop at the first failing FAIL_TO_PASS test or collection error')
+    args = parser.parse_args()
     if os.path.exists("./_aa_test"):
         os.system("./_aa_test")
         return
     os.chdir('/testbed')
-    sp.run("/meta/patched_eval.sh 2>&1", shell=True)
+    script_path = EVAL_SCRIPT
+    if args.fast:
+        script_path = prepare_fast(work_dir, args.sample)
+    if args.abort_early:
+        with open(INSTANCE_PATH, 'r') as f:
+            instance = json.load(f)
+        fail_to_pass = load_tests(instance, 'FAIL_TO_PASS')
+        run_abort_early(script_path, fail_to_pass, fail_to_pass + load_tests(instance, 'PASS_TO_PASS'))
+        return
+    sp.run(f"{script_path} 2>&1", shell=True)
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import re
+
+# Line-by-line scanner of test logs, in a single pass.
+#
+# The output of aa_test can be many megabytes.  The scanner is fed the log
+# as it is produced (or read), line by line, and keeps only what grading
+# needs: the first exception, the test output between the markers of
+# the eval script, and the status of each test as soon as the test
+# runner reports it, so failures can be reported before the run is over.
+# It does not depend on swebench; the final statuses are computed by the
+# swebench log parsers from test_output() (see swe_eval.LogEvaluator).
+
+START_TEST_OUTPUT = '>>>>> Start Test Output'
+END_TEST_OUTPUT = '>>>>> End Test Output'
+# printed by aa_test --abort-early when it kills the test run
+ABORTED_TEST_OUTPUT = '>>>>> Test Run Aborted Early'
+
+PASSED = 'PASSED'
+FAILED = 'FAILED'
+ERROR = 'ERROR'
+SKIPPED = 'SKIPPED'
+
+# pytest -rA summary: "FAILED tests/test_x.py::test_y - AssertionError"
+PYTEST_SUMMARY = re.compile(r'^(PASSED|FAILED|ERROR|SKIPPED|XFAIL|XPASS) (\S+)')
+# pytest -v: "tests/test_x.py::test_y PASSED  [ 10%]"
+PYTEST_VERBOSE = re.compile(r'^(\S+::\S+) (PASSED|FAILED|ERROR|SKIPPED|XFAIL|XPASS)\b')
+# django: "test_y (app.tests.Class) ... ok"
+DJANGO = re.compile(r'^(\w+ \([\w.]+\)) \.\.\. (ok|FAIL|ERROR|skipped|expected failure|unexpected success)')
+# sympy: "test_y ok" / "test_y F" / "test_y E"
+SYMPY = re.compile(r'^(test_\w+) (ok|F|E|f|s|X)$')
+# pytest cannot collect a test module, e.g. because the code under test
+# cannot be imported:
+#   "ImportError while importing test module '/testbed/tests/test_x.py'."
+#   "______ ERROR collecting tests/test_x.py ______"
+COLLECT_ERROR = re.compile(r"^(?:ImportError while importing test module '([^']+)'|_+ ERROR collecting (\S+) _+$)")
+# pytest collected the tests without errors and starts running them
+COLLECTED = re.compile(r'^collected \d+ items?\b(?!.*\berrors?\b)')
+
+PYTEST_STATUS = {'PASSED': PASSED, 'FAILED': FAILED, 'ERROR': ERROR, 'SKIPPED': SKIPPED, 'XFAIL': PASSED, 'XPASS': FAILED}
+DJANGO_STATUS = {'ok': PASSED, 'FAIL': FAILED, 'ERROR': ERROR, 'skipped': SKIPPED, 'expected failure': PASSED, 'unexpected success': FAILED}
+SYMPY_STATUS = {'ok': PASSED, 'F': FAILED, 'E': ERROR, 'f': PASSED, 's': SKIPPED, 'X': FAILED}
+
+class TestLogScanner:
+    def __init__ (self, on_status=None, modules=None):
+        # on_status(name, status) is called whenever a test reports.
+        # modules: the test files whose collection errors are reported in
+        # collect_error; None for all.
+        self.on_status = on_status
+        self.modules = modules
+        self.collecting = True      # until the tests start running
+        self.partial = ''
+        self.statuses = {}
+        self.started = False
+        self.ended = False
+        self.content = []           # the test output, between the markers
+        self.collect_error = None   # the first line reporting a test module that cannot be collected
+        self.aborted = None         # the reason, if aa_test aborted the run
+        self.exception = None       # lines of the first exception
+        self.exception_done = False
+        self.after_separator = False
+        self.skip_line = False
+
+    def feed (self, text):
+        # Feeds a chunk of the log; lines may be split across chunks.
+        lines = (self.partial + text).split('\n')
+        self.partial = lines.pop()
+        for line in lines:
+            self.feed_line(line + '\n')
+
+    def close (self):
+        if self.partial:
+            self.feed_line(self.partial)
+            self.partial = ''
+
+    def feed_line (self, line):
+        self.scan_exception(line)
+        off = line.find(ABORTED_TEST_OUTPUT)
+        if off >= 0 and self.aborted is None:
+            self.aborted = line[off + len(ABORTED_TEST_OUTPUT):].strip(' :\n') or 'aborted'
+        if not self.started:
+            off = line.find(START_TEST_OUTPUT)
+            if off >= 0:
+                self.started = True
+                line = line[off + len(START_TEST_OUTPUT):]
+            else:
+                return
+        elif self.ended:
+            return
+        off = line.find(END_TEST_OUTPUT)
+        if off < 0:
+            off = line.find(START_TEST_OUTPUT)
+        if off >= 0:
+            self.ended = True
+            line = line[:off]
+        self.content.append(line)
+        self.scan_status(line.rstrip('\n'))
+
+    def scan_exception (self, line):
+        # The first "ERROR:" block following a "=====" line, from the
+        # traceback to the next "-----" line.
+        if self.exception_done:
+            return
+        if self.exception is not None:
+            if self.skip_line:
+                self.skip_line = False
+            elif line.startswith('----------------'):
+                self.exception_done = True
+            else:
+                self.exception.append(line)
+            return
+        if self.after_separator and line.startswith('ERROR:'):
+            self.exception = [line]
+            self.skip_line = True
+            return
+        self.after_separator = line.startswith('===========')
+
+    def scan_status (self, line):
+        if self.collecting:
+            self.scan_collection(line)
+        m = PYTEST_SUMMARY.match(line)
+        if m is not None:
+            self.set_status(m.group(2), PYTEST_STATUS[m.group(1)])
+            return
+        m = PYTEST_VERBOSE.match(line)
+        if m is not None:
+            self.set_status(m.group(1), PYTEST_STATUS[m.group(2)])
+            return
+        m = DJANGO.match(line)
+        if m is not None:
+            self.set_status(m.group(1), DJANGO_STATUS[m.group(2)])
+            return
+        m = SYMPY.match(line)
+        if m is not None:
+            self.set_status(m.group(1), SYMPY_STATUS[m.group(2)])
+
+    def scan_collection (self, line):
+        # Once the tests run, an ImportError is the failure of a test,
+        # not of the run.
+        if COLLECTED.match(line):
+            self.collecting = False
+            return
+        m = COLLECT_ERROR.match(line)
+        if m is None or self.collect_error is not None:
+            return
+        if self.is_module(m.group(1) or m.group(2)):
+            self.collect_error = line
+
+    def is_module (self, path):
+        if self.modules is None:
+            return True
+        for module in self.modules:
+            if path == module or path.endswith('/' + module):
+                return True
+        return False
+
+    def set_status (self, name, status):
+        self.collecting = False
+        self.statuses[name] = status
+        if self.on_status is not None:
+            self.on_status(name, status)
+
+    def first_exception (self):
+        return self.exception or []
+
+    def test_output (self):
+        return ''.join(self.content)
+
+    def failed (self, names):
+        # The tests among names reported failed so far.
+        return [name for name in names if self.statuses.get(name, None) in (FAILED, ERROR)]
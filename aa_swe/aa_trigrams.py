@@ -0,0 +1,257 @@
+import os
+import re
+import mmap
+import struct
+from array import array
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+try:
+    import re._parser as sre_parse
+except ImportError:
+    import sre_parse
+
+# Trigram index of the text files of the repo, for aa_grep.
+#
+# For every file the set of (ASCII lower-cased) byte trigrams is recorded,
+# and inverted into trigram -> sorted list of file ids.  A regex is
+# reduced to the literal strings any match must contain; only files that
+# have all trigrams of those literals can match, and only those are
+# scanned.
+#
+# Layout (little endian), read with mmap and binary search:
+#
+#     header      MAGIC, n_files, n_trigrams, n_postings, files blob size, top size
+#     top         utf-8 path of the indexed directory
+#     file table  n_files x (path offset, path length, mtime_ns, size)
+#     files blob  utf-8 paths relative to top, starting with './'
+#     trigrams    n_trigrams x (trigram, postings offset, postings count), sorted
+#     postings    n_postings x uint32 file id
+#
+# Files modified after the index was built are listed, one absolute path
+# per line, in DIRTY_NAME.  aa_grep always scans them in addition to the
+# candidates, so the index does not need to be rebuilt after every edit.
+
+TRIGRAMS_NAME = 'index.tri'
+DIRTY_NAME = 'index.dirty'
+BAKED_TRIGRAMS = '/meta/index.tri'     # built with the image by swe_build_docker
+MAGIC = b'AATRI001'
+HEADER = struct.Struct('<8sIIIII4x')
+FILE = struct.Struct('<IIqq')
+TRIGRAM = struct.Struct('<3sxII')
+MAX_FILE_SIZE = 1024 * 1024
+BINARY_CHECK_SIZE = 8192
+SKIP_DIRS = {'.git', '__pycache__'}
+PARALLEL_MIN_FILES = 200
+SHARDS_PER_JOB = 4
+
+def list_text_files (top):
+    # Returns the keys of the files to index under top, in os.walk order.
+    keys = []
+    for root, dirs, files in os.walk(top):
+        dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        for file in files:
+            keys.append(os.path.join('.', os.path.relpath(os.path.join(root, file), top)))
+    return keys
+
+def file_trigrams (full_path):
+    # Returns (mtime_ns, size, trigrams) or None for files not indexed.
+    try:
+        st = os.stat(full_path)
+        if st.st_size > MAX_FILE_SIZE or not os.path.isfile(full_path):
+            return None
+        with open(full_path, 'rb') as f:
+            content = f.read()
+    except OSError:
+        return None
+    if b'\0' in content[:BINARY_CHECK_SIZE]:
+        return None
+    content = content.lower()
+    return st.st_mtime_ns, st.st_size, {content[i:i+3] for i in range(len(content) - 2)}
+
+def is_binary (full_path):
+    try:
+        with open(full_path, 'rb') as f:
+            return b'\0' in f.read(BINARY_CHECK_SIZE)
+    except OSError:
+        return True
+
+def index_shard (top, keys):
+    results = []
+    for key in keys:
+        result = file_trigrams(os.path.join(top, key))
+        if result is not None:
+            results.append((key,) + result)
+    return results
+
+def build_trigrams (path, top, jobs=None, name=None):
+    # Index the text files under top and write the index to path.  name is
+    # the path of top where the index is used, if different, e.g. /testbed
+    # for an index built with the image.
+    top = os.path.abspath(top)
+    keys = list_text_files(top)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+        if len(keys) < PARALLEL_MIN_FILES:
+            jobs = 1
+    if jobs <= 1:
+        results = index_shard(top, keys)
+    else:
+        n_shards = jobs * SHARDS_PER_JOB
+        shard_size = (len(keys) + n_shards - 1) // n_shards
+        shards = [keys[i:i+shard_size] for i in range(0, len(keys), shard_size)]
+        results = []
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for shard_results in executor.map(index_shard, [top] * len(shards), shards):
+                results.extend(shard_results)
+
+    postings = defaultdict(list)
+    file_table = bytearray()
+    files_blob = bytearray()
+    for file_id, (key, mtime, size, trigrams) in enumerate(results):
+        encoded = key.encode('utf-8')
+        file_table += FILE.pack(len(files_blob), len(encoded), mtime, size)
+        files_blob += encoded
+        for trigram in trigrams:
+            postings[trigram].append(file_id)
+    trigram_table = bytearray()
+    posting_array = array('I')
+    for trigram in sorted(postings.keys()):
+        ids = postings[trigram]
+        trigram_table += TRIGRAM.pack(trigram, len(posting_array), len(ids))
+        posting_array.extend(ids)
+    encoded_top = (name or top).encode('utf-8')
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(results), len(postings), len(posting_array), len(files_blob), len(encoded_top)))
+        f.write(encoded_top)
+        f.write(file_table)
+        f.write(files_blob)
+        f.write(trigram_table)
+        f.write(posting_array.tobytes())
+    os.replace(tmp_path, path)
+
+class TrigramIndex:
+    def __init__ (self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n_files, self.n_trigrams, self.n_postings, files_size, top_size = HEADER.unpack_from(self.data, 0)
+        assert magic == MAGIC, f"{path} is not a trigram index"
+        self.top = self.data[HEADER.size:HEADER.size + top_size].decode('utf-8')
+        self.file_table = HEADER.size + top_size
+        self.files_blob = self.file_table + self.n_files * FILE.size
+        self.trigrams = self.files_blob + files_size
+        self.postings = self.trigrams + self.n_trigrams * TRIGRAM.size
+
+    def close (self):
+        self.data.close()
+
+    def file (self, file_id):
+        # Returns (key, mtime_ns, size).
+        off, length, mtime, size = FILE.unpack_from(self.data, self.file_table + file_id * FILE.size)
+        return self.data[self.files_blob + off:self.files_blob + off + length].decode('utf-8'), mtime, size
+
+    def files (self):
+        return [self.file(i) for i in range(self.n_files)]
+
+    def posting (self, trigram):
+        lo, hi = 0, self.n_trigrams
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.data[self.trigrams + mid * TRIGRAM.size:self.trigrams + mid * TRIGRAM.size + 3] < trigram:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo >= self.n_trigrams:
+            return set()
+        found, off, count = TRIGRAM.unpack_from(self.data, self.trigrams + lo * TRIGRAM.size)
+        if found != trigram:
+            return set()
+        ids = array('I')
+        ids.frombytes(self.data[self.postings + off * 4:self.postings + (off + count) * 4])
+        return set(ids)
+
+    def candidates (self, literals):
+        # Ids of the files containing all trigrams of all literals, or None
+        # if the literals have no trigram, i.e. every file is a candidate.
+        result = None
+        for literal in literals:
+            data = literal.lower()
+            for i in range(len(data) - 2):
+                ids = self.posting(data[i:i+3])
+                result = ids if result is None else result & ids
+                if len(result) == 0:
+                    return result
+        return result
+
+def required_literals (pattern, flags=0):
+    # Literal strings (as utf-8 bytes) that every match of the regex must
+    # contain.  Only runs of plain characters in the top-level sequence
+    # are used, which is conservative: anything else ends a run.
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except Exception:
+        return []
+    ignore_case = bool((flags | parsed.state.flags) & re.IGNORECASE)
+    literals = []
+    run = []
+    def end_run ():
+        if len(run) >= 3:
+            text = ''.join(run)
+            # non-ASCII case folding is not covered by the ASCII lower-casing
+            if not (ignore_case and not text.isascii()):
+                literals.append(text.encode('utf-8'))
+        run.clear()
+    for op, arg in parsed:
+        if op == sre_parse.LITERAL:
+            run.append(chr(arg))
+        else:
+            end_run()
+    end_run()
+    return literals
+
+def mark_dirty (root, paths):
+    with open(os.path.join(root, DIRTY_NAME), 'a') as f:
+        for path in paths:
+            f.write(os.path.abspath(path) + '\n')
+
+def read_dirty (root):
+    path = os.path.join(root, DIRTY_NAME)
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        return [line.rstrip('\n') for line in f if line.strip()]
+
+def reset_dirty (root, paths=[]):
+    with open(os.path.join(root, DIRTY_NAME), 'w') as f:
+        for path in paths:
+            f.write(path + '\n')
+
+def changed_since_built (index):
+    # Absolute paths of files that are new or differ from when the index
+    # was built.
+    known = {}
+    for key, mtime, size in index.files():
+        known[key] = (mtime, size)
+    changed = []
+    for key in list_text_files(index.top):
+        full_path = os.path.normpath(os.path.join(index.top, key))
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            continue
+        signature = known.get(key, None)
+        if signature is None:
+            # new, or not indexed because too large or binary
+            if st.st_size > MAX_FILE_SIZE or is_binary(full_path):
+                continue
+        elif signature == (st.st_mtime_ns, st.st_size):
+            continue
+        changed.append(full_path)
+    return changed
+
+def open_trigrams (root):
+    path = os.path.join(root, TRIGRAMS_NAME)
+    if not os.path.exists(path):
+        return None
+    return TrigramIndex(path)
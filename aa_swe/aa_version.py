@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+import os
+import sys
+import hashlib
+
+# A stamp of the aa_swe source, to tell whether the copy of aa_swe
+# installed in an image (see swe_build_docker) is the same as the source
+# mounted at /aa_swe; shell_stub.sh only reinstalls if it is not.
+#
+#     python3 -m aa_swe.aa_version [source dir]
+
+STAMP_PATH = '/opt/aa_swe.stamp'    # written when the image is built
+SKIP_DIRS = {'__pycache__', '.git'}
+
+def source_files (top):
+    # setup.py and the package, relative to top, sorted.
+    paths = ['setup.py']
+    package = os.path.join(top, 'aa_swe')
+    for root, dirs, files in os.walk(package):
+        dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS)
+        for file in files:
+            if file.endswith('.pyc'):
+                continue
+            paths.append(os.path.relpath(os.path.join(root, file), top))
+    return sorted(paths)
+
+def source_stamp (top):
+    sha1 = hashlib.sha1()
+    for path in source_files(top):
+        full_path = os.path.join(top, path)
+        if not os.path.isfile(full_path):
+            continue
+        with open(full_path, 'rb') as f:
+            content = f.read()
+        sha1.update(f"{path}\0{len(content)}\0".encode('utf-8'))
+        sha1.update(content)
+    return sha1.hexdigest()
+
+def main ():
+    top = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    print(source_stamp(top))
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,19 @@
 #!/bin/bash
 source /opt/miniconda3/bin/activate
 conda activate testbed
+export AA_SWE_WORK_DIR=/output
 cd /aa_swe
-/usr/bin/python3 -m pip install .
+# aa_swe is installed in the image; reinstall only if the mounted source
+# differs from the installed one (see aa_version); the new stamp is kept
+# for containers committed from this one (swe_fork)
+stamp=$(/usr/bin/python3 -m aa_swe.aa_version /aa_swe)
+if [ "$stamp" != "$(cat /opt/aa_swe.stamp 2> /dev/null)" ]; then
+    /usr/bin/python3 -m pip install . && echo "$stamp" > /opt/aa_swe.stamp
+fi
 aa_init
 cd /testbed
-export AA_SWE_WORK_DIR=/output
-/usr/bin/python3 /shell_stub.py
+# keeps aa_* state in memory; the aa_* commands work without it too
+aa_daemon 2> /output/aa_daemon.log &
+# announce to the host that setup is done, with the IP to reach the stub
+hostname -i | awk '{print $1}' > /output/.ready.tmp && mv /output/.ready.tmp /output/ready
+exec /usr/bin/python3 /shell_stub.py
@@ -1,24 +1,32 @@
 #!/usr/bin/env python3
 import os
-import pickle
+from glob import glob
+from aa_swe.swe_store import open_store
 
 ROOT=os.environ.get("AA_SWE_ROOT", None)
 assert not ROOT is None, "Please set the AA_SWE_ROOT environment variable"
 
+_store = None
+
+def get_store ():
+    global _store
+    if _store is None:
+        _store = open_store(ROOT)
+    return _store
+
 def load_instance (instance_id):
-    with open(os.path.join(ROOT, "datasets.pkl"), "rb") as f:
-        datasets = pickle.load(f)
-    split = None
-    instance = None
-    for sp, dataset in datasets.items():
-        instance = dataset.get(instance_id, None)
-        if instance is not None:
-            split = sp
-            break
+    instance = get_store().get(instance_id)
     assert instance is not None, f"Instance {instance_id} not found in any split"
-    instance['split'] = split
     return instance
 
+def has_result (instance_id, work_dir='.'):
+    # Whether an attempt directory of the instance already has a patch or
+    # has been marked failed.
+    for marker in ["patch", "failed"]:
+        if len(glob(os.path.join(work_dir, instance_id + '.*', marker))) > 0:
+            return True
+    return False
+
 class Env:
     def __init__(self, instance_id):
         self.instance_id = instance_id
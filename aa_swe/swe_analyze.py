@@ -1,42 +1,62 @@
 #!/usr/bin/env python3
 import os
-import json
+import argparse
 import pkg_resources
-from glob import glob
 import pandas as pd
+from aa_swe.swe_trace import TraceIndex
+from aa_swe.swe_stat import collect
+from aa_swe.swe_catalog import open_catalog, attempts
 
-def scan_trace_and_log (solved):
-    for path in glob("*/trace.mbox"):
-        parent_path = os.path.dirname(path)
-        with open(os.path.join(parent_path, "instance.json"), "r") as f:
-            instance = json.load(f)
-        instance_id = instance['instance_id']
-        with open(path, "r") as f:
-            text = f.read()
-        off = text.find("New ticket:")
-        if off < 0:
+ANALYZE_CACHE = '.swe_analyze.csv'
+
+def trace_info (path):
+    # Whether the solve of trace.mbox began and whether a test passed.
+    index = TraceIndex(path)
+    start = index.ticket_start()
+    if start is None:
+        return {'begun': 0, 'congratulated': 0}
+    # the test result that congratulates is near the end
+    congratulated = any('Congratulations!' in index.body(i) for i in reversed(range(start, len(index))))
+    return {'begun': 1, 'congratulated': int(congratulated)}
+
+def scan_trace_and_log (solved, jobs=None, rebuild=False):
+    catalog = open_catalog(rescan=rebuild)
+    rows = attempts(catalog)
+    traces = {}
+    for attempt in rows:
+        path = os.path.join(attempt['output_dir'], 'trace.mbox')
+        if os.path.exists(path):
+            traces[path] = attempt['instance_id']
+    records = collect(list(traces.keys()), trace_info, ANALYZE_CACHE, jobs)
+    for path, instance_id in traces.items():
+        record = records[path]
+        if not record['begun']:
             continue
-        if 'Congratulations!' in text[off:]:
+        if record['congratulated']:
             solved.add(instance_id)
             continue
         yield instance_id
 
-    for path in glob("*/report.json"):
-        instance_id = path.split("/")[0]
-        with open(path, "r") as f:
-            report = f.read()
-        if '"resolved": false,' in report:
-            yield instance_id
+    # evaluated attempts
+    for attempt in rows:
+        if attempt['resolved'] is None:
+            continue
+        if not attempt['resolved']:
+            yield attempt['instance_id']
         else:
-            solved.add(instance_id)
+            solved.add(attempt['instance_id'])
 
 def main():
+    parser = argparse.ArgumentParser(description='List the failed instances in the current directory.')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Processes to read the traces with; default all cores')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the results catalog from the attempt directories')
+    args = parser.parse_args()
     survey_path = pkg_resources.resource_filename('aa_swe', 'data/survey.csv')
     survey = pd.read_csv(survey_path, dtype={'instance_id': str, 'solved': int})
     survey_dict = survey.set_index('instance_id')['solved'].to_dict()
     failed = []
     done = set()
-    for instance_id in scan_trace_and_log(done):
+    for instance_id in scan_trace_and_log(done, args.jobs, args.rebuild):
         solved = survey_dict.get(instance_id, 0)
         failed.append((instance_id, solved))
     failed.sort(key=lambda x: x[1])
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+import os
+import sys
+import csv
+import json
+import time
+import threading
+import argparse
+import subprocess as sp
+from glob import glob
+from concurrent.futures import ThreadPoolExecutor
+
+# Solve many instances concurrently.
+#
+# The queue is persisted in a JSON file after every change, so a crashed
+# or interrupted batch resumes where it left off: finished instances are
+# not run again, and instances that were running are put back in the
+# queue.
+
+DEFAULT_QUEUE = 'batch_queue.json'
+DEFAULT_SUMMARY = 'batch_summary.csv'
+DEFAULT_LOG_DIR = 'batch_logs'
+DEFAULT_MEM_PER_SOLVE = 4.0     # GB
+SUMMARY_FIELDS = ['instance_id', 'outcome', 'wall_time', 'cost', 'trials', 'output_dir']
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+
+def available_memory_gb ():
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024 / 1024
+    except OSError:
+        pass
+    return None
+
+def default_concurrency (mem_per_solve=DEFAULT_MEM_PER_SOLVE):
+    # Each solve runs a container and the tests in it, so bound by both
+    # cores and memory.
+    concurrency = os.cpu_count() or 1
+    mem = available_memory_gb()
+    if mem is not None and mem_per_solve > 0:
+        concurrency = min(concurrency, int(mem / mem_per_solve))
+    return max(1, concurrency)
+
+class BatchScheduler:
+    # solver: called with an instance ID, returns a dict with (some of)
+    #         SUMMARY_FIELDS.  Called from worker threads.
+    # skip: called with an instance ID; instances for which it returns
+    #       True are not run.
+
+    def __init__ (self, queue_path, solver, concurrency=1, skip=None, stop=None):
+        self.queue_path = queue_path
+        self.solver = solver
+        self.concurrency = concurrency
+        self.skip = skip
+        self.stop = stop
+        self.lock = threading.Lock()
+        self.entries = {}       # instance_id -> {'status', ... summary fields}
+        if os.path.exists(queue_path):
+            with open(queue_path, 'r') as f:
+                self.entries = json.load(f)
+            for entry in self.entries.values():
+                if entry['status'] == RUNNING:
+                    # the batch died while this was running
+                    entry['status'] = PENDING
+
+    def save (self):
+        tmp_path = self.queue_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(tmp_path, self.queue_path)
+
+    def add (self, instance_ids):
+        with self.lock:
+            for instance_id in instance_ids:
+                if instance_id not in self.entries:
+                    self.entries[instance_id] = {'status': PENDING}
+            self.save()
+
+    def pending (self):
+        return [instance_id for instance_id, entry in self.entries.items() if entry['status'] == PENDING]
+
+    def update (self, instance_id, **kwargs):
+        with self.lock:
+            self.entries[instance_id].update(kwargs)
+            self.save()
+
+    def run_one (self, instance_id):
+        if self.stop is not None and self.stop():
+            return
+        if self.skip is not None and self.skip(instance_id):
+            self.update(instance_id, status=DONE, outcome='skipped')
+            return
+        self.update(instance_id, status=RUNNING, started=time.time())
+        begin = time.time()
+        try:
+            result = self.solver(instance_id)
+        except Exception as e:
+            result = {'outcome': 'error', 'error': str(e)}
+        result = dict(result)
+        result.setdefault('wall_time', time.time() - begin)
+        self.update(instance_id, status=DONE, **result)
+        print(f"{instance_id}: {result.get('outcome', None)} ({result['wall_time']:.1f}s)")
+
+    def run (self):
+        todo = self.pending()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for _ in executor.map(self.run_one, todo):
+                pass
+        return self.entries
+
+    def write_summary (self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            for instance_id, entry in self.entries.items():
+                if entry['status'] != DONE:
+                    continue
+                writer.writerow(dict(entry, instance_id=instance_id))
+
+def latest_output_dir (instance_id, since):
+    dirs = [d for d in glob(instance_id + '.*') if os.path.isdir(d) and os.path.getmtime(d) >= since - 1]
+    if len(dirs) == 0:
+        return None
+    return max(dirs, key=os.path.getmtime)
+
+class SubprocessSolver:
+    # Runs swe_solve for the instance and reads the summary.json it
+    # writes into its output directory.
+
+    def __init__ (self, solve_args, log_dir=DEFAULT_LOG_DIR):
+        self.solve_args = solve_args
+        self.log_dir = log_dir
+        os.makedirs(log_dir, exist_ok=True)
+
+    def __call__ (self, instance_id):
+        begin = time.time()
+        with open(os.path.join(self.log_dir, f"{instance_id}.log"), 'a') as log:
+            result = sp.run(['swe_solve', '-i', instance_id] + self.solve_args, stdout=log, stderr=sp.STDOUT)
+        output_dir = latest_output_dir(instance_id, begin)
+        summary = {'outcome': 'error', 'output_dir': output_dir}
+        if output_dir is not None:
+            summary_path = os.path.join(output_dir, 'summary.json')
+            if os.path.exists(summary_path):
+                with open(summary_path, 'r') as f:
+                    summary.update(json.load(f))
+        if result.returncode != 0:
+            summary['outcome'] = 'error'
+        summary['wall_time'] = time.time() - begin
+        return summary
+
+def read_instance_list (path):
+    with open(path, 'r') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+def main ():
+    parser = argparse.ArgumentParser(description='Solve many instances concurrently.  Arguments not listed here are passed on to swe_solve.')
+    parser.add_argument('-i', '--instance', nargs='*', default=[], help='Instance IDs to solve')
+    parser.add_argument('-l', '--list', default=None, help='File with one instance ID per line')
+    parser.add_argument('--split', default=None, help='Solve all instances of the split')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of concurrent solves (default: bounded by cores and memory)')
+    parser.add_argument('--mem-per-solve', type=float, default=DEFAULT_MEM_PER_SOLVE, help='Memory in GB to reserve per concurrent solve')
+    parser.add_argument('--queue', default=DEFAULT_QUEUE, help='The persisted queue, used to resume')
+    parser.add_argument('--summary', default=DEFAULT_SUMMARY, help='Per-instance summary CSV')
+    parser.add_argument('-f', '--force', action='store_true', help='Also solve instances that already have a patch or failed marker')
+    args, solve_args = parser.parse_known_args()
+
+    instance_ids = list(args.instance)
+    if args.list is not None:
+        instance_ids.extend(read_instance_list(args.list))
+    if args.split is not None:
+        from aa_swe.swe import get_store
+        instance_ids.extend(sorted(get_store().ids(args.split)))
+    if len(instance_ids) == 0 and not os.path.exists(args.queue):
+        sys.stderr.write("Nothing to solve; give -i, -l or --split\n")
+        return 1
+
+    concurrency = args.jobs or default_concurrency(args.mem_per_solve)
+    if args.force:
+        solve_args = solve_args + ['--force']
+        skip = None
+    else:
+        from aa_swe.swe import has_result
+        skip = has_result
+    scheduler = BatchScheduler(args.queue, SubprocessSolver(solve_args), concurrency,
+                               skip=skip, stop=lambda: os.path.exists("quit"))
+    scheduler.add(instance_ids)
+    print(f"{len(scheduler.pending())} instances to solve, {concurrency} at a time")
+    scheduler.run()
+    scheduler.write_summary(args.summary)
+    print(f"Summary written to {args.summary}")
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,120 @@
 #!/usr/bin/env python3
 import os
 import json
-import subprocess as sp
+import shutil
 import argparse
+import threading
+import subprocess as sp
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from swebench.harness.test_spec.test_spec import make_test_spec
-from aa_swe.swe import load_instance, ROOT
+from aa_swe.swe import load_instance, get_store, ROOT
+from aa_swe.aa_index import INDEX_NAME, build_index, write_index
+from aa_swe.aa_trigrams import TRIGRAMS_NAME, build_trigrams
+from aa_swe.aa_version import STAMP_PATH, source_stamp
 
-def main():
-    parser = argparse.ArgumentParser(description='Build docker image for a given instance')
-    parser.add_argument('-i', '--instance', type=str, required=True, help='The instance ID to process')
-    parser.add_argument('-f', '--force', action='store_true', help='Force rebuild of the docker image')
-    args = parser.parse_args()
+# Builds the aa_swe.<instance> docker images, one or many at a time.
+#
+# Building is idempotent: an instance whose image exists is skipped
+# (unless forced), and the work directory of an interrupted build is
+# started over, so a batch can simply be run again.
+#
+# The testbed is a shallow fetch of only the base commit from the bare
+# mirror in ROOT/repos, instead of a full clone.  git worktree or object
+# alternates would be cheaper still on the host, but the testbed is
+# copied into the image, where the paths they point to do not exist.
+#
+# flask and pyflakes, needed by the shell stub, are downloaded once into
+# ROOT/docker/wheelhouse.<python> and installed from there, without the
+# network, in a layer of their own, instead of by pip from the network in
+# every build.  They are downloaded by the python of the SWE-bench image,
+# which is the one that installs them, so the wheels fit its version and
+# platform; a wheelhouse is kept for each python the images have.
+#
+# aa_swe itself is installed in the image too, in the last layers, with a
+# stamp of its source (see aa_version).  The entrypoint reinstalls it only
+# if the source mounted at /aa_swe has a different stamp.
 
-    image_name = f"aa_swe.{args.instance}"
-    
-    if not args.force:
-        result = sp.run(f"docker image inspect {image_name}:latest >/dev/null 2>&1", shell=True)
-        if result.returncode == 0:
-            print(f"Docker image {image_name}:latest already exists. Use -f to force rebuild.")
-            return
+WHEELHOUSE_PACKAGES = ['flask', 'pyflakes']
+IMAGE_PYTHON = '/usr/bin/python3'       # installs the packages in the image
+PYTHON_TAG = "import sys, sysconfig; print(f'cp{sys.version_info[0]}{sys.version_info[1]}-' + sysconfig.get_platform())"
+AA_SWE_SOURCE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UPLOAD_PACK = 'git -c uploadpack.allowAnySHA1InWant=true upload-pack'
 
-    work_dir = os.path.join(ROOT, 'docker', 'docker.' + args.instance)
-    meta_dir = os.path.join(work_dir, "meta")
-    testbed_dir = os.path.join(work_dir, "testbed")
+_wheelhouse_lock = threading.Lock()
+
+def image_exists (image_name):
+    return sp.run(['docker', 'image', 'inspect', f"{image_name}:latest"], stdout=sp.DEVNULL, stderr=sp.DEVNULL).returncode == 0
+
+def run (args, log, cwd=None):
+    # Runs a command, appending its output to log.  Returns True on success.
+    result = sp.run(args, cwd=cwd, stdout=sp.PIPE, stderr=sp.STDOUT)
+    log.write(f"$ {' '.join(args)}\n{result.stdout.decode('utf-8', errors='ignore')}")
+    return result.returncode == 0
+
+def image_python_tag (base_image, log):
+    # e.g. cp310-linux-x86_64; None on failure.
+    result = sp.run(['docker', 'run', '--rm', base_image, IMAGE_PYTHON, '-c', PYTHON_TAG], stdout=sp.PIPE, stderr=sp.STDOUT)
+    out = result.stdout.decode('utf-8', errors='ignore').strip()
+    if result.returncode != 0 or len(out.split()) != 1:
+        log.write(f"cannot get the python of {base_image}:\n{out}\n")
+        return None
+    return out
+
+def prepare_wheelhouse (base_image, log):
+    # Downloads the packages the image needs on top of the SWE-bench image,
+    # once for all builds whose images have the same python.
+    tag = image_python_tag(base_image, log)
+    if tag is None:
+        return None
+    wheelhouse = os.path.join(ROOT, 'docker', f"wheelhouse.{tag}")
+    with _wheelhouse_lock:
+        if not os.path.exists(wheelhouse):
+            tmp_dir = wheelhouse + '.partial'
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            # by the python of the image, as the host's user
+            if not run(['docker', 'run', '--rm', '--user', f"{os.getuid()}:{os.getgid()}",
+                        '-v', f"{os.path.abspath(tmp_dir)}:/wheels", base_image,
+                        IMAGE_PYTHON, '-m', 'pip', 'download', '--quiet', '--no-cache-dir', '--dest', '/wheels']
+                       + WHEELHOUSE_PACKAGES, log):
+                return None
+            os.rename(tmp_dir, wheelhouse)
+    return wheelhouse
+
+def link_tree (src, dst):
+    # Hard links src into the build context, which cannot refer outside.
+    os.makedirs(dst, exist_ok=True)
+    for name in os.listdir(src):
+        try:
+            os.link(os.path.join(src, name), os.path.join(dst, name))
+        except OSError:
+            shutil.copy(os.path.join(src, name), os.path.join(dst, name))
+
+def copy_source (src, dst):
+    # The part of the aa_swe source that is installed.
+    os.makedirs(dst)
+    shutil.copy(os.path.join(src, 'setup.py'), dst)
+    shutil.copytree(os.path.join(src, 'aa_swe'), os.path.join(dst, 'aa_swe'),
+                    ignore=shutil.ignore_patterns('__pycache__', '*.pyc', '.git'))
+    with open(os.path.join(os.path.dirname(dst), 'aa_swe.stamp'), 'w') as f:
+        f.write(source_stamp(dst) + '\n')
+
+def checkout_testbed (repo_dir, commit, testbed_dir, log):
+    # Only the base commit, fetched from the local mirror.
+    return (run(['git', 'init', '--quiet', testbed_dir], log)
+        and run(['git', '-C', testbed_dir, 'fetch', '--quiet', '--depth', '1',
+                 '--upload-pack', UPLOAD_PACK, f"file://{os.path.abspath(repo_dir)}", commit], log)
+        and run(['git', '-C', testbed_dir, 'checkout', '--quiet', 'FETCH_HEAD'], log))
 
-    instance = load_instance(args.instance)
-    assert instance is not None
-    spec = make_test_spec(instance)
-    os.makedirs(meta_dir, exist_ok=False)
+def write_meta (instance, spec, meta_dir):
     with open(os.path.join(meta_dir, "instance.json"), "w") as f:
         json.dump(instance, f)
 
     eval_path = os.path.join(meta_dir, "eval.sh")
     with open(eval_path, "w") as f:
         f.write(spec.eval_script)
-    os.system(f"chmod +x {eval_path}")
-    
+    os.chmod(eval_path, 0o755)
+
     patched_setup_path = os.path.join(meta_dir, "patched_setup.sh")
     patched_eval_path = os.path.join(meta_dir, "patched_eval.sh")
     patched_script = spec.eval_script.replace("git ", "true ")
@@ -47,7 +126,6 @@ def main():
     assert test_offset != 0
     with open(patched_setup_path, "w") as f:
         f.write(patched_script[:test_offset])
-        f.write("/usr/bin/python3 -m pip install flask pyflakes\n")
     with open(patched_eval_path, "w") as f:
         f.write("#!/bin/bash\n")
         f.write("set -uxo pipefail\n")
@@ -56,21 +134,104 @@ def main():
         # we'll rely on the stub to load the anaconda environment
         f.write("cd /testbed\n")
         f.write(patched_script[test_offset:])
-    os.system(f"chmod +x {patched_setup_path}")
-    os.system(f"chmod +x {patched_eval_path}")
+    os.chmod(patched_setup_path, 0o755)
+    os.chmod(patched_eval_path, 0o755)
 
     with open(os.path.join(meta_dir, "test_patch"), "w") as f:
         f.write(instance['test_patch'])
     with open(os.path.join(meta_dir, "groundtruth"), "w") as f:
         f.write(instance['patch'])
-    os.system(f'git clone --no-checkout {ROOT}/repos/{spec.repo} {testbed_dir}')
-    os.system(f'cd {testbed_dir} && git checkout {instance["base_commit"]}')
-    os.system(f'cd {testbed_dir} && git apply ../meta/test_patch && git commit -a -m test')
-    with open(os.path.join(work_dir, "Dockerfile"), "w") as f:
-        f.write(f"FROM sweb.eval.x86_64.{args.instance}:aa\n")
-        f.write("COPY ./testbed /testbed\n")
-        f.write("COPY ./meta /meta\n")
-        f.write("RUN /meta/patched_setup.sh\n")
-        f.write("WORKDIR /testbed\n")
-
-    os.system(f"cd {work_dir}; docker build -t {image_name} .")
\ No newline at end of file
+
+def build_image (instance_id, force=False, index_jobs=None):
+    # Returns (status, log); status is 'built', 'exists' or 'failed'.
+    image_name = f"aa_swe.{instance_id}"
+    if not force and image_exists(image_name):
+        return 'exists', ''
+
+    work_dir = os.path.join(ROOT, 'docker', 'docker.' + instance_id)
+    meta_dir = os.path.join(work_dir, "meta")
+    testbed_dir = os.path.join(work_dir, "testbed")
+    # left over by an interrupted or older build
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(meta_dir)
+    log_path = os.path.join(work_dir, "build.log")
+    with open(log_path, "w") as log:
+        base_image = f"sweb.eval.x86_64.{instance_id}:aa"
+        if sp.run(['docker', 'image', 'inspect', base_image], stdout=sp.DEVNULL, stderr=sp.DEVNULL).returncode != 0:
+            log.write(f"SWE-bench image {base_image} not found\n")
+            return 'failed', log_path
+        instance = load_instance(instance_id)
+        assert instance is not None
+        spec = make_test_spec(instance)
+        write_meta(instance, spec, meta_dir)
+
+        wheelhouse = prepare_wheelhouse(base_image, log)
+        if wheelhouse is None:
+            return 'failed', log_path
+        link_tree(wheelhouse, os.path.join(work_dir, "wheels"))
+
+        if not checkout_testbed(os.path.join(ROOT, 'repos', spec.repo), instance["base_commit"], testbed_dir, log):
+            return 'failed', log_path
+        if not (run(['git', 'apply', os.path.join(meta_dir, 'test_patch')], log, cwd=testbed_dir)
+                and run(['git', 'commit', '--quiet', '-a', '-m', 'test'], log, cwd=testbed_dir)):
+            return 'failed', log_path
+        copy_source(AA_SWE_SOURCE, os.path.join(work_dir, "aa_swe_src"))
+        # index the source with the image, so aa_init only has to re-parse
+        # the files that differ when the container starts
+        write_index(os.path.join(meta_dir, INDEX_NAME), build_index(testbed_dir, jobs=index_jobs))
+        build_trigrams(os.path.join(meta_dir, TRIGRAMS_NAME), testbed_dir, jobs=index_jobs, name='/testbed')
+        with open(os.path.join(work_dir, "Dockerfile"), "w") as f:
+            f.write(f"FROM {base_image}\n")
+            # the packages first: this layer doesn't change when the
+            # instance is rebuilt
+            f.write("COPY ./wheels /wheels\n")
+            # --no-index: a wheelhouse that does not fit fails the build
+            # instead of falling back to the network
+            f.write(f"RUN {IMAGE_PYTHON} -m pip install --no-index --find-links /wheels {' '.join(WHEELHOUSE_PACKAGES)}\n")
+            f.write("COPY ./testbed /testbed\n")
+            f.write("COPY ./meta /meta\n")
+            f.write("RUN /meta/patched_setup.sh\n")
+            # last, so a new version of aa_swe reuses the layers above
+            f.write("COPY ./aa_swe_src /opt/aa_swe_src\n")
+            f.write("RUN /usr/bin/python3 -m pip install /opt/aa_swe_src\n")
+            f.write(f"COPY ./aa_swe.stamp {STAMP_PATH}\n")
+            f.write("WORKDIR /testbed\n")
+        log.flush()
+        if not run(['docker', 'build', '-t', image_name, '.'], log, cwd=work_dir):
+            return 'failed', log_path
+    return 'built', log_path
+
+def main():
+    parser = argparse.ArgumentParser(description='Build docker images for the given instances')
+    parser.add_argument('-i', '--instance', action='append', default=[], help='The instance ID to process; can be repeated')
+    parser.add_argument('--split', default=None, help='Build all instances of the split')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of images to build concurrently')
+    parser.add_argument('-f', '--force', action='store_true', help='Force rebuild of the docker image')
+    args = parser.parse_args()
+
+    instance_ids = list(args.instance)
+    if args.split is not None:
+        instance_ids.extend(sorted(get_store().ids(args.split)))
+    if len(instance_ids) == 0:
+        parser.error("give -i or --split")
+
+    # with concurrent builds, parallelism comes from the builds
+    index_jobs = None if args.jobs <= 1 else 1
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        futures = {executor.submit(build_image, instance_id, args.force, index_jobs): instance_id for instance_id in instance_ids}
+        for i, future in enumerate(as_completed(futures)):
+            instance_id = futures[future]
+            try:
+                status, log_path = future.result()
+            except Exception as e:
+                status, log_path = 'failed', str(e)
+            if status == 'exists':
+                print(f"[{i+1}/{len(instance_ids)}] Docker image aa_swe.{instance_id}:latest already exists. Use -f to force rebuild.")
+            elif status == 'built':
+                print(f"[{i+1}/{len(instance_ids)}] built aa_swe.{instance_id}")
+            else:
+                print(f"[{i+1}/{len(instance_ids)}] \033[91mFAILED\033[0m aa_swe.{instance_id}: {log_path}")
+                failed.append(instance_id)
+    if len(failed) > 0:
+        return 1
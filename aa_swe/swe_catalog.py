@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+import os
+import json
+import sqlite3
+import logging
+import argparse
+from glob import glob
+
+# The results catalog: one row per attempt (output directory) in the
+# results directory, kept in results.db there, so that swe_list,
+# swe_submit and swe_analyze don't have to open every attempt directory.
+#
+# swe_solve adds the attempt when it starts and fills in the outcome when
+# it finishes.  The report.json of an evaluation, copied in later, is
+# picked up by attempts() for the attempts not evaluated yet.  The
+# directories remain the truth: the catalog is rebuilt from them when it
+# does not exist, or with --rebuild.
+#
+#     swe_catalog [--rebuild]
+
+CATALOG_NAME = 'results.db'
+TIMEOUT = 60        # seconds to wait for concurrent solves writing
+
+COLUMNS = [
+    ('output_dir', 'TEXT PRIMARY KEY'),     # relative to the results directory
+    ('instance_id', 'TEXT'),
+    ('split', 'TEXT'),
+    ('outcome', 'TEXT'),        # 'solved', 'failed', 'cancelled', or NULL if not finished
+    ('model', 'TEXT'),
+    ('started', 'REAL'),
+    ('finished', 'REAL'),
+    ('wall_time', 'REAL'),
+    ('cost', 'REAL'),
+    ('trials', 'INTEGER'),
+    ('resolved', 'INTEGER'),    # from report.json; NULL if not evaluated
+]
+
+def open_catalog (work_dir='.', rescan=False):
+    # rescan: rebuild the catalog from the directories
+    path = os.path.join(work_dir, CATALOG_NAME)
+    exists = os.path.exists(path)
+    conn = sqlite3.connect(path, timeout=TIMEOUT)
+    conn.row_factory = sqlite3.Row
+    # concurrent solves of a batch write to the same catalog
+    conn.execute("PRAGMA journal_mode=WAL")
+    columns = ', '.join(f"{name} {decl}" for name, decl in COLUMNS)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS attempts ({columns})")
+    conn.execute("CREATE INDEX IF NOT EXISTS attempts_instance ON attempts (instance_id)")
+    conn.commit()
+    if rescan or not exists:
+        rebuild(conn, work_dir)
+    return conn
+
+def record (conn, output_dir, commit=True, **fields):
+    # Adds or updates the attempt; only the given fields are changed.
+    fields['output_dir'] = os.path.normpath(output_dir)
+    names = list(fields.keys())
+    updates = ', '.join(f"{name}=excluded.{name}" for name in names if name != 'output_dir')
+    conn.execute(f"INSERT INTO attempts ({', '.join(names)}) VALUES ({', '.join('?' * len(names))}) "
+                 f"ON CONFLICT(output_dir) DO UPDATE SET {updates}",
+                 [fields[name] for name in names])
+    if commit:
+        conn.commit()
+
+def record_attempt (output_dir, **fields):
+    # Records the attempt in the catalog of the directory it is in.  The
+    # catalog is only an index: failing to write it doesn't fail the solve.
+    output_dir = os.path.abspath(output_dir)
+    try:
+        conn = open_catalog(os.path.dirname(output_dir))
+        try:
+            record(conn, os.path.basename(output_dir), **fields)
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logging.warning(f"cannot record {output_dir} in the results catalog: {e}")
+
+def scan_attempt (output_dir):
+    # The row of an attempt directory; None if it is not one.
+    instance_path = os.path.join(output_dir, 'instance.json')
+    if not os.path.exists(instance_path):
+        return None
+    with open(instance_path, 'r') as f:
+        instance = json.load(f)
+    row = {
+        'instance_id': instance['instance_id'],
+        'split': instance.get('split', None),
+        'started': os.path.getmtime(instance_path),
+    }
+    for outcome, marker in [('solved', 'patch'), ('failed', 'failed')]:
+        marker_path = os.path.join(output_dir, marker)
+        if os.path.exists(marker_path):
+            row['outcome'] = outcome
+            row['finished'] = os.path.getmtime(marker_path)
+            break
+    summary_path = os.path.join(output_dir, 'summary.json')
+    if os.path.exists(summary_path):
+        with open(summary_path, 'r') as f:
+            summary = json.load(f)
+        for key in ['outcome', 'model', 'wall_time', 'cost', 'trials']:
+            if key in summary:
+                row[key] = summary[key]
+    resolved = read_resolved(output_dir)
+    if resolved is not None:
+        row['resolved'] = resolved
+    return row
+
+def read_resolved (output_dir):
+    # 1 or 0 from the report.json of the attempt; None if not evaluated.
+    report_path = os.path.join(output_dir, 'report.json')
+    if not os.path.exists(report_path):
+        return None
+    with open(report_path, 'r') as f:
+        report = f.read()
+    return int('"resolved": false,' not in report)
+
+def rebuild (conn, work_dir='.'):
+    # Rescans the attempt directories, in one transaction.  Returns the
+    # number of attempts.
+    conn.execute("DELETE FROM attempts")
+    n = 0
+    for path in glob(os.path.join(work_dir, '*', 'instance.json')):
+        output_dir = os.path.dirname(path)
+        row = scan_attempt(output_dir)
+        if row is None:
+            continue
+        record(conn, os.path.relpath(output_dir, work_dir), commit=False, **row)
+        n += 1
+    conn.commit()
+    return n
+
+def attempts (conn, outcome=None, work_dir='.'):
+    # Rows of the attempts, oldest first.  Attempts not evaluated yet are
+    # looked at for a report.json, one stat each.
+    if outcome is None:
+        rows = conn.execute("SELECT * FROM attempts ORDER BY started")
+    else:
+        rows = conn.execute("SELECT * FROM attempts WHERE outcome = ? ORDER BY started", (outcome,))
+    rows = [dict(row) for row in rows]
+    updated = False
+    for row in rows:
+        if row['resolved'] is not None:
+            continue
+        resolved = read_resolved(os.path.join(work_dir, row['output_dir']))
+        if resolved is not None:
+            row['resolved'] = resolved
+            record(conn, row['output_dir'], commit=False, resolved=resolved)
+            updated = True
+    if updated:
+        conn.commit()
+    return rows
+
+def main ():
+    parser = argparse.ArgumentParser(description='The results catalog of the current directory.')
+    parser.add_argument('--rebuild', action='store_true', help='Rescan the attempt directories')
+    args = parser.parse_args()
+    conn = open_catalog(rescan=args.rebuild)
+    for row in conn.execute("SELECT outcome, COUNT(*), COUNT(DISTINCT instance_id), SUM(cost) FROM attempts GROUP BY outcome"):
+        outcome, n, instances, cost = tuple(row)
+        print(f"{outcome or 'unfinished'}: {n} attempts, {instances} instances, cost {cost or 0:.2f}")
+
+if __name__ == "__main__":
+    main()
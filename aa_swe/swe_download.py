@@ -1,26 +1,106 @@
 import os
-import pickle
-from datasets import load_dataset
+import sys
+import time
+import shutil
+import argparse
+import subprocess as sp
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from aa_swe.swe import ROOT
+from aa_swe.swe_store import write_store, open_store
 
-def main ():
+DEFAULT_JOBS = 8
+DEFAULT_RETRIES = 3
+# bare clones don't have a fetch refspec configured, so give one explicitly
+FETCH_REFSPECS = ['+refs/heads/*:refs/heads/*', '+refs/tags/*:refs/tags/*']
+
+def run_git (args, log):
+    result = sp.run(['git'] + args, stdout=sp.PIPE, stderr=sp.STDOUT)
+    log.append(f"$ git {' '.join(args)}\n{result.stdout.decode('utf-8', errors='ignore')}")
+    return result.returncode == 0
+
+def mirror_repo (repo, source, retries=DEFAULT_RETRIES, backoff=2.0):
+    # Clone repo from source into ROOT/repos, or fetch into it if it
+    # already exists.  Returns (repo, action, ok, log).
+    repo_dir = os.path.join(ROOT, "repos", repo)
+    log = []
+    if os.path.exists(os.path.join(repo_dir, "config")):
+        action = 'fetch'
+        args = ['--git-dir', repo_dir, 'fetch', '--prune', '--quiet', source] + FETCH_REFSPECS
+    else:
+        action = 'clone'
+        # clone into a temporary directory and rename, so an interrupted
+        # clone never looks like a finished one
+        tmp_dir = repo_dir + '.partial'
+        args = ['clone', '--quiet', '--no-checkout', '--bare', source, tmp_dir]
+    for attempt in range(retries):
+        if attempt > 0:
+            time.sleep(backoff * (2 ** (attempt - 1)))
+        if action == 'clone':
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(os.path.dirname(repo_dir), exist_ok=True)
+        if run_git(args, log):
+            if action == 'clone':
+                shutil.rmtree(repo_dir, ignore_errors=True)
+                os.rename(tmp_dir, repo_dir)
+            return repo, action, True, ''.join(log)
+    if action == 'clone':
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return repo, action, False, ''.join(log)
+
+def repo_source (repo, from_local):
+    if from_local is None:
+        return f"https://github.com/{repo}.git"
+    return os.path.abspath(os.path.join(from_local, repo))
+
+def mirror_repos (repos, from_local=None, jobs=DEFAULT_JOBS, retries=DEFAULT_RETRIES):
+    repos = sorted(set(repos))
+    results = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(mirror_repo, repo, repo_source(repo, from_local), retries) for repo in repos]
+        for i, future in enumerate(as_completed(futures)):
+            repo, action, ok, log = future.result()
+            status = 'ok' if ok else 'FAILED'
+            print(f"[{i+1}/{len(repos)}] {action} {repo}: {status}")
+            if not ok:
+                sys.stderr.write(log)
+            results.append((repo, action, ok))
+    return results
+
+def print_summary (results):
+    cloned = sum(1 for _, action, ok in results if ok and action == 'clone')
+    fetched = sum(1 for _, action, ok in results if ok and action == 'fetch')
+    failed = [repo for repo, _, ok in results if not ok]
+    print(f"Cloned: {cloned}, Updated: {fetched}, Failed: {len(failed)}")
+    for repo in failed:
+        print(f"\033[91mFAILED\033[0m {repo}")
+
+def load_datasets ():
+    from datasets import load_dataset
     datasets = {}
     for split in ['dev', 'test']:
         swebench = load_dataset('princeton-nlp/SWE-bench_Lite', split=split)
         dataset = {}
         datasets[split] = dataset
         for instance in swebench:
-            instance_id = instance['instance_id']
-            dataset[instance_id] = instance
-            repo = instance['repo']
-            repo_url = f"https://github.com/{instance['repo']}.git"
-            repo_dir = os.path.join(ROOT, "repos", instance['repo'])
-
-            if os.path.exists(os.path.join(repo_dir, "config")):
-                print(f"repo {repo} already exists, not downloading")
-                continue
-            os.makedirs(repo_dir, exist_ok=True)
-            os.system(f'git clone --no-checkout --bare {repo_url} {repo_dir}')
-    with open(os.path.join(ROOT, "datasets.pkl"), "wb") as f:
-        pickle.dump(datasets, f)
+            dataset[instance['instance_id']] = instance
+    return datasets
+
+def main ():
+    parser = argparse.ArgumentParser(description='Download the SWE-bench dataset and mirror the repositories.')
+    parser.add_argument('-j', '--jobs', type=int, default=DEFAULT_JOBS, help='Number of repositories to mirror concurrently')
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES, help='Attempts per repository before giving up')
+    parser.add_argument('--from-local', default=None, help='Mirror from DIR/owner/name bare repos instead of github')
+    parser.add_argument('--repos-only', action='store_true', help='Take the repo list from the existing instance store; do not download the dataset')
+    args = parser.parse_args()
 
+    if args.repos_only:
+        repos = [instance['repo'] for instance in open_store(ROOT)]
+    else:
+        datasets = load_datasets()
+        cnt = write_store(ROOT, datasets)
+        print(f"Wrote {cnt} instances to the instance store")
+        repos = [instance['repo'] for dataset in datasets.values() for instance in dataset.values()]
+    results = mirror_repos(repos, args.from_local, args.jobs, args.retries)
+    print_summary(results)
+    if any(not ok for _, _, ok in results):
+        return 1
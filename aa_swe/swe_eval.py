@@ -2,31 +2,159 @@
 import os
 import sys
 import json
+import time
+import argparse
 from swebench.harness.test_spec.test_spec import make_test_spec
-from swebench.harness.grading import get_eval_report, get_logs_eval, get_eval_tests_report, get_resolution_status
+from swebench.harness.grading import get_eval_tests_report, get_resolution_status
+from swebench.harness.log_parsers import MAP_REPO_TO_PARSER
 from swebench.harness.constants import (
     KEY_INSTANCE_ID,
     FAIL_TO_PASS,
     PASS_TO_PASS,
     FAIL_ONLY_REPOS,
+    APPLY_PATCH_FAIL,
+    RESET_FAILED,
+    TESTS_ERROR,
+    TESTS_TIMEOUT,
     EvalType,
     ResolvedStatus,
 )
+from aa_swe.aa_testlog import TestLogScanner, FAILED, ERROR
 
-def extract_first_exception(stdout_file):
-    with open(stdout_file, 'r') as file:
-        lines = file.readlines()
-    for i in range(len(lines)):
-        if lines[i].startswith("===========") and (i+1 < len(lines)):
-            if not lines[i+1].startswith("ERROR:"):
+# The log is read once, in chunks, by LogEvaluator.  Previously it was
+# read by extract_first_exception, get_eval_report and get_logs_eval
+# each.  LogEvaluator checks for the same conditions as get_logs_eval and
+# calls the same swebench log parser, once, on the test output.
+
+BAD_CODES = [APPLY_PATCH_FAIL, RESET_FAILED, TESTS_ERROR, TESTS_TIMEOUT]
+CHUNK_SIZE = 1024 * 1024
+FOLLOW_INTERVAL = 0.2
+FOLLOW_IDLE = 600
+
+class LogEvaluator:
+    def __init__ (self, spec, selected=None, on_status=None):
+        # selected: {FAIL_TO_PASS: [...], PASS_TO_PASS: [...]} to grade
+        #           only these tests, e.g. fast_tests.json of aa_test --fast
+        # on_status(name, status): called as soon as a test reports
+        self.spec = spec
+        self.eval_ref = {
+            KEY_INSTANCE_ID: spec.instance_id,
+            FAIL_TO_PASS: spec.FAIL_TO_PASS,
+            PASS_TO_PASS: spec.PASS_TO_PASS,
+        }
+        if selected is not None:
+            self.eval_ref[FAIL_TO_PASS] = selected[FAIL_TO_PASS]
+            self.eval_ref[PASS_TO_PASS] = selected[PASS_TO_PASS]
+        self.selected = selected is not None
+        self.scanner = TestLogScanner(on_status)
+        self.bad_codes = set()
+        self.tail = ''
+
+    def feed (self, text):
+        # the tail covers codes split across chunks
+        window = self.tail + text
+        for code in BAD_CODES:
+            if code in window:
+                self.bad_codes.add(code)
+        self.tail = window[-max(len(code) for code in BAD_CODES):]
+        self.scanner.feed(text)
+
+    def first_exception (self):
+        return self.scanner.first_exception()
+
+    def early_failures (self):
+        # FAIL_TO_PASS tests already reported failed by the test runner.
+        return self.scanner.failed(self.eval_ref[FAIL_TO_PASS])
+
+    def finish (self):
+        # Returns the report of get_eval_tests_report, or None if the log
+        # has no valid test output.
+        self.scanner.close()
+        if len(self.bad_codes) > 0 or not (self.scanner.started and self.scanner.ended):
+            return None
+        status_map = MAP_REPO_TO_PARSER[self.spec.repo](self.scanner.test_output(), self.spec)
+        eval_type = EvalType.FAIL_ONLY if self.spec.repo in FAIL_ONLY_REPOS \
+            else EvalType.PASS_AND_FAIL
+        return get_eval_tests_report(status_map, self.eval_ref, eval_type=eval_type)
+
+    def result (self):
+        report = self.finish()
+        return EvalResult(report, self.first_exception(), self.selected,
+                          aborted=self.scanner.aborted, early_failures=self.early_failures())
+
+def is_resolved (report):
+    return get_resolution_status(report) == ResolvedStatus.FULL.value
+
+class EvalResult:
+    # The outcome of grading one test run, see evaluate().
+    def __init__ (self, report, first_exception, selected=False, aborted=None, early_failures=[]):
+        self.report = report                    # None if the log has no valid test output
+        self.first_exception = first_exception  # lines, empty if none
+        self.selected = selected                # only the tests of aa_test --fast were graded
+        self.aborted = aborted                  # why aa_test --abort-early killed the run
+        self.resolved = aborted is None and report is not None and len(first_exception) == 0 and is_resolved(report)
+        self.failed_fail_to_pass = [] if report is None else report[FAIL_TO_PASS]['failure']
+        self.failed_pass_to_pass = [] if report is None else report[PASS_TO_PASS]['failure']
+        if aborted is not None:
+            # the run is incomplete, only the failures seen so far are known
+            self.failed_fail_to_pass = early_failures
+
+    def format (self):
+        # The text shown to the agent.
+        if self.aborted is not None:
+            text = f"The test run was aborted early, the remaining tests did not run: {self.aborted}\n"
+            if len(self.first_exception) > 0:
+                text += ' '.join(self.first_exception) + '\n'
+            return text
+        if len(self.first_exception) > 0:
+            return ' '.join(self.first_exception) + '\n'
+        if self.report is None:
+            return ''
+        if self.resolved:
+            if self.selected:
+                # not final: only a part of the tests has run
+                return "All selected tests passed.  Run aa_test without --fast to run all the tests; only then is the issue resolved.\n"
+            return "Congratulations! You have resolved the issue.\n"
+        text = ''
+        for name, failed in [('You failed the following tests:', self.failed_fail_to_pass), ('You broke the following tests previously already passed:', self.failed_pass_to_pass)]:
+            if len(failed) == 0:
                 continue
-            traceback_lines = [lines[i+1]]
-            for j in range(i+3, len(lines)):
-                if lines[j].startswith("----------------"):
-                    break
-                traceback_lines.append(lines[j])
-            return traceback_lines
-    return []
+            text += name + '\n'
+            for f in failed:
+                text += f"\t{f}\n"
+        return text
+
+def evaluate (spec, output, selected=None):
+    # Grades the output of aa_test in-process.  spec is the TestSpec of
+    # the instance; callers grading many runs should make it once.
+    evaluator = LogEvaluator(spec, selected)
+    evaluator.feed(output)
+    return evaluator.result()
+
+def read_log (evaluator, f, follow=False):
+    # Feeds the log from f.  With follow, waits for the log to grow until
+    # the end of the test output, or until it stays idle for FOLLOW_IDLE.
+    idle_since = time.time()
+    while True:
+        text = f.read(CHUNK_SIZE)
+        if text:
+            evaluator.feed(text)
+            idle_since = time.time()
+            continue
+        if not follow or evaluator.scanner.ended or time.time() - idle_since > FOLLOW_IDLE:
+            break
+        time.sleep(FOLLOW_INTERVAL)
+
+def extract_first_exception(stdout_file):
+    scanner = TestLogScanner()
+    with open(stdout_file, 'r') as f:
+        while True:
+            text = f.read(CHUNK_SIZE)
+            if not text:
+                break
+            scanner.feed(text)
+    scanner.close()
+    return scanner.first_exception()
 
 def print_error_details (traceback_lines, radius_before = 20, radius_after = 2):
     sys.stdout.write("First Exception Traceback:\n")
@@ -83,45 +211,38 @@ def print_error_details (traceback_lines, radius_before = 20, radius_after = 2):
         sys.stdout.write("\n!!! Important: you are not allowed to modify the test cases.\n")
 
 def main ():
-    stdout_path = sys.argv[1]
-
-    lines = extract_first_exception(stdout_path)
-    if len(lines) > 0:
-        print(' '.join(lines))
-        return
-
-    instance_dir = os.path.dirname(stdout_path)
+    parser = argparse.ArgumentParser(description='Grade the test output of an instance.')
+    parser.add_argument('stdout', help='The output of aa_test, - for stdin')
+    parser.add_argument('--selected', default=None, help='fast_tests.json of aa_test --fast; grade only the tests selected')
+    parser.add_argument('--instance', default=None, help='instance.json (default: next to the output)')
+    parser.add_argument('--follow', action='store_true', help='Follow the output while the test runs, and report failures early')
+    args = parser.parse_args()
+    stdout_path = args.stdout
 
-    with open(os.path.join(instance_dir, "instance.json"), "r") as f:
+    instance_path = args.instance
+    if instance_path is None:
+        instance_dir = '.' if stdout_path == '-' else os.path.dirname(stdout_path)
+        instance_path = os.path.join(instance_dir, "instance.json")
+    with open(instance_path, "r") as f:
         instance = json.load(f)
     spec = make_test_spec(instance)
 
-    prediction = {
-        'instance_id': spec.instance_id,
-        'model_name_or_path': 'aaa',
-        'model_patch': '',
-    }
-    report = get_eval_report(test_spec=spec, prediction=prediction, test_log_path=stdout_path, include_tests_status=True)
-    eval_status_map, found = get_logs_eval(spec, stdout_path)
-    if not found:
-        return
-    eval_type = EvalType.FAIL_ONLY if spec.repo in FAIL_ONLY_REPOS \
-        else EvalType.PASS_AND_FAIL
-    eval_ref = {
-            KEY_INSTANCE_ID: spec.instance_id,
-            FAIL_TO_PASS: spec.FAIL_TO_PASS,
-            PASS_TO_PASS: spec.PASS_TO_PASS,
-        }            
-    report = get_eval_tests_report(
-            eval_status_map, eval_ref, eval_type=eval_type
-        )            
-    if get_resolution_status(report) == ResolvedStatus.FULL.value:
-        print("Congratulations! You have resolved the issue.")
+    selected = None
+    if args.selected is not None:
+        with open(args.selected, 'r') as f:
+            selected = json.load(f)
+
+    follow = args.follow or stdout_path == '-'
+    reported = set()
+    def on_status (name, status):
+        if follow and status in (FAILED, ERROR) and name in evaluator.eval_ref[FAIL_TO_PASS] and name not in reported:
+            reported.add(name)
+            print(f"Early report: FAIL_TO_PASS test failed: {name}", flush=True)
+    evaluator = LogEvaluator(spec, selected, on_status)
+    if stdout_path == '-':
+        read_log(evaluator, sys.stdin)
     else:
-        for name, key in [('You failed the following tests:', 'FAIL_TO_PASS'), ('You broke the following tests previously already passed:', 'PASS_TO_PASS')]:
-            failed = report[key]['failure']
-            if len(failed) == 0:
-                continue
-            print(name)
-            for f in failed:
-                print(f"\t{f}")
\ No newline at end of file
+        with open(stdout_path, 'r') as f:
+            read_log(evaluator, f, follow=follow)
+    result = evaluator.result()
+    sys.stdout.write(result.format())
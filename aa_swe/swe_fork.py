@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import shutil
+import signal
+import datetime
+import argparse
+import subprocess as sp
+from aa_swe.swe import has_result
+from aa_swe.swe_pool import DockerBackend, wait_ready
+from aa_swe.aa_index import INDEX_NAME
+from aa_swe.aa_symbols import SYMBOLS_NAME
+from aa_swe.aa_trigrams import TRIGRAMS_NAME, DIRTY_NAME
+
+# Several attempts at one instance, in parallel, from a common checkpoint.
+#
+# One container is started and set up (aa_swe installed, aa_init done),
+# and then snapshotted with docker commit.  K swe_solve processes are
+# started from the snapshot, each in its own container and output
+# directory, with the index built during the setup copied in, so none of
+# them repeats the setup.  Attempts can use different models (-m can be
+# repeated).  When one of them writes a patch, the others are cancelled
+# with SIGTERM, and swe_solve shuts their containers down.
+#
+#     swe_fork -i sympy__sympy-22005 -k 3 -m openai/gpt-4o-mini -m openai/gpt-4o -b 0.1
+#
+# Arguments swe_fork does not know are passed on to swe_solve.
+
+FORK_DIR = '.fork'              # setup output directories, not results
+SESSION_FILES = [INDEX_NAME, SYMBOLS_NAME, TRIGRAMS_NAME, DIRTY_NAME]
+POLL_INTERVAL = 1.0
+
+def checkpoint (backend, instance_id, timestamp):
+    # Starts and sets up a container, and commits it to an image.
+    # Returns (image, setup output dir), image being None on failure.
+    image = f"aa_swe.{instance_id}"
+    name = f"{instance_id}-{timestamp}-setup"
+    setup_dir = os.path.abspath(os.path.join(FORK_DIR, f"{instance_id}.{timestamp}"))
+    os.makedirs(setup_dir)
+    if not backend.image_exists(image):
+        print(f"Docker image {image}:latest does not exist. Rebuilding")
+        os.system(f"swe_build_docker -i {instance_id}")
+    backend.start(image, name, setup_dir)
+    try:
+        ip, seconds = wait_ready(backend, name, setup_dir, alive=lambda: backend.is_running(name))
+        if ip is None:
+            return None, setup_dir
+        print(f"Container {name} ready in {seconds:.1f}s")
+        checkpoint_image = f"aa_swe.{instance_id}.fork.{timestamp}"
+        if not backend.commit(name, checkpoint_image):
+            return None, setup_dir
+        return checkpoint_image, setup_dir
+    finally:
+        backend.kill(name)
+
+def start_attempt (instance_id, image, setup_dir, output_dir, model, solve_args):
+    # Returns (Popen, log file); the log is closed when the attempt is
+    # reaped (see cancel).
+    os.makedirs(output_dir)
+    # aa_init finds the index of the setup in /output and keeps it
+    for name in SESSION_FILES:
+        path = os.path.join(setup_dir, name)
+        if os.path.exists(path):
+            shutil.copy(path, os.path.join(output_dir, name))
+    command = ['swe_solve', '-i', instance_id, '--image', image, '--output_dir', output_dir, '-f'] + solve_args
+    if model is not None:
+        command.extend(['-m', model])
+    log = open(os.path.join(output_dir, 'fork.log'), 'w')
+    try:
+        return sp.Popen(command, stdout=log, stderr=sp.STDOUT), log
+    except:
+        log.close()
+        raise
+
+def wait_first_patch (attempts):
+    # attempts: [(output_dir, Popen, log)].  Returns the output dir of the
+    # first attempt that writes a patch, or None if all end without one.
+    while True:
+        for output_dir, proc, _ in attempts:
+            if os.path.exists(os.path.join(output_dir, 'patch')):
+                return output_dir
+        if all(proc.poll() is not None for _, proc, _ in attempts):
+            return None
+        time.sleep(POLL_INTERVAL)
+
+def cancel (attempts, winner=None):
+    # The winner is left to finish by itself.
+    for output_dir, proc, _ in attempts:
+        if output_dir != winner and proc.poll() is None:
+            proc.terminate()
+    for _, proc, log in attempts:
+        proc.wait()
+        log.close()
+
+def main ():
+    parser = argparse.ArgumentParser(description='Solve an instance with parallel attempts from a checkpoint.')
+    parser.add_argument('-i', '--instance', type=str, required=True, help='The instance ID to process')
+    parser.add_argument('-k', '--attempts', type=int, default=2, help='Number of parallel attempts')
+    parser.add_argument('-m', '--model', action='append', default=[], help='Model of the attempts; repeat to use several in turn')
+    parser.add_argument('-f', '--force', action='store_true', help='Solve even if the instance has a result')
+    args, solve_args = parser.parse_known_args()
+    if has_result(args.instance) and not args.force:
+        sys.stderr.write(f"Work directories already exist, not solving\n")
+        return
+
+    # SIGTERM: cancel the attempts and clean up like on ^C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    backend = DockerBackend()
+    image = None
+    setup_dir = None
+    attempts = []
+    winner = None
+    try:
+        image, setup_dir = checkpoint(backend, args.instance, timestamp)
+        if image is None:
+            sys.stderr.write(f"Failed to set up a container for {args.instance}\n")
+            return 1
+        for k in range(args.attempts):
+            model = args.model[k % len(args.model)] if len(args.model) > 0 else None
+            output_dir = f"{args.instance}.{timestamp}.fork{k}"
+            proc, log = start_attempt(args.instance, image, setup_dir, output_dir, model, solve_args)
+            attempts.append((output_dir, proc, log))
+            print(f"Started attempt {output_dir}" + ("" if model is None else f" with {model}"))
+        winner = wait_first_patch(attempts)
+        if winner is not None:
+            print(f"\033[92mSOLVED\033[0m by {winner}; cancelling the other attempts")
+        else:
+            print(f"\033[91mFAILED\033[0m no attempt found a patch")
+    finally:
+        cancel(attempts, winner)
+        if image is not None:
+            backend.remove_image(image)
+        if setup_dir is not None:
+            shutil.rmtree(setup_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
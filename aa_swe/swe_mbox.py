@@ -1,18 +1,41 @@
 #!/usr/bin/env python3
 import sys
 import os
-import tkinter as tk
-from tkinter import ttk, scrolledtext
-import mailbox
+import re
+import html
 from glob import glob
 import logging
-from pygments import highlight
-from pygments.lexers import get_lexer_by_name
-from pygments.formatters import HtmlFormatter
-from tkinterhtml import HtmlFrame  # You need to install tkinterhtml
+import argparse
+import queue
+import threading
+from aa_swe.swe_trace import TraceIndex, read_headers, read_body
+
+# Viewer of the traces in the current directory.
+#
+#     swe_mbox [TRACE]                                  # the Tk GUI
+#     swe_mbox search REGEX [TRACE ...] [-i] [--subject] [--all]
+#     swe_mbox export TRACE [TRACE ...] [--html] [-m N ...] [-o OUT]
+#
+# search and export run without a display: tkinter is only imported by
+# the GUI.  Both use the cached index of swe_trace, so only the bodies of
+# the messages are read again.  Messages are numbered as in the GUI, from
+# the last "New ticket" on (--all: from the beginning of the trace).
 
 FONT_SIZE = 18  # Define a constant for the font size
 FONT_SIZE_BODY = 28  # Define a constant for the email body font size
+POLL_MS = 50  # How often the UI takes the messages indexed so far
+PAGE_SIZE = 500  # Subjects added to the listbox per poll
+BODY_PAGE = 64 * 1024  # Characters of an email body shown at a time
+MAX_MATCH_LINES = 5  # Matching lines of a body printed by search
+EXPORT_HEADERS = ['From', 'To', 'Cc', 'Subject', 'Date']
+
+def find_traces():
+    return sorted(glob("*.trace.*") + glob(os.path.join("*", "trace.mbox")))
+
+def conversation(index, from_start=False):
+    # [(number, entry)] of the messages shown, numbered from 1.
+    start = 0 if from_start else (index.ticket_start(last=True) or 0)
+    return [(i - start + 1, index[i]) for i in range(start, len(index))]
 
 class EmailViewer:
     def __init__(self, root, mbox_file=None):
@@ -67,9 +90,24 @@ class EmailViewer:
         self.email_headers = tk.Text(self.header_frame, wrap=tk.WORD, state='disabled', font=self.font, height=5)
         self.email_headers.pack(fill=tk.X)
         
+        # Button to show the next page of a long email body
+        self.more_button = ttk.Button(self.content_frame, text="More", command=self.show_more_content, state='disabled')
+        self.more_button.pack(side=tk.BOTTOM, fill=tk.X)
+
         # Create a Text widget to display email content as plain text with a fixed-width font
         self.email_content = tk.Text(self.content_frame, wrap=tk.WORD, state='normal', font=('Courier', FONT_SIZE_BODY))
         self.email_content.pack(fill=tk.BOTH, expand=True)
+
+        # Traces are indexed on a background thread, which passes the
+        # entries of the messages to the UI thread through this queue
+        self.trace_path = None
+        self.generation = 0
+        self.queue = queue.Queue()
+        self.pending = []
+        self.emails = []
+        self.body = ''
+        self.body_shown = 0
+        self.root.after(POLL_MS, self.poll_queue)
         
         # Load trace files
         self.load_trace_files()
@@ -83,7 +121,7 @@ class EmailViewer:
         
         
     def load_trace_files(self):
-        self.all_trace_files = glob("*.trace.*")
+        self.all_trace_files = find_traces()
         self.update_trace_listbox(self.all_trace_files)
     
     def update_trace_listbox(self, files):
@@ -92,7 +130,6 @@ class EmailViewer:
             self.trace_listbox.insert(tk.END, trace_file)
     
     def filter_trace_files(self, event):
-        import re
         pattern = self.trace_search_entry.get()
         try:
             regex = re.compile(pattern)
@@ -112,54 +149,180 @@ class EmailViewer:
         self.load_emails(trace_file)
     
     def load_emails(self, mbox_file):
-        self.mbox = mailbox.mbox(mbox_file)
+        # The listbox is filled as the trace is indexed, see poll_queue.
+        self.generation += 1
+        self.trace_path = mbox_file
+        self.pending = []
         self.emails = []
         self.email_listbox.delete(0, tk.END)
-        msgs = list(self.mbox)
-        last_aa_ticket_index = -1
-        for i, message in enumerate(msgs):
-            subject = message['Subject'] or "No Subject"
+        thread = threading.Thread(target=self.index_trace, args=(mbox_file, self.generation), daemon=True)
+        thread.start()
+
+    def index_trace(self, mbox_file, generation):
+        # On the background thread.
+        # entries are only appended while the trace is scanned
+        sent = [0]
+        def send(entries):
+            self.queue.put((generation, entries[sent[0]:]))
+            sent[0] = len(entries)
+        try:
+            index = TraceIndex(mbox_file, on_progress=send)
+            send(index.entries)
+        except Exception as e:
+            logging.error(f"Failed to index {mbox_file}: {e}")
+
+    def poll_queue(self):
+        try:
+            while True:
+                generation, entries = self.queue.get_nowait()
+                if generation != self.generation:
+                    continue    # of a trace that is no longer selected
+                self.pending.extend(entries)
+        except queue.Empty:
+            pass
+        # a page at a time, so the UI stays responsive
+        page = self.pending[:PAGE_SIZE]
+        del self.pending[:PAGE_SIZE]
+        for entry in page:
+            subject = entry['subject'] or "No Subject"
             if subject.lower().startswith("new ticket:"):
-                last_aa_ticket_index = i
-        last_aa_ticket_index = max(last_aa_ticket_index, 0)
-        for i, message in enumerate(msgs[last_aa_ticket_index:]):
-            subject = message['Subject'] or "No Subject"
-            self.emails.append(message)
-            self.email_listbox.insert(tk.END, f"{i+1}: {subject}")
-        
+                # show from the last ticket on, skipping the replayed memory
+                self.emails = []
+                self.email_listbox.delete(0, tk.END)
+            self.emails.append(entry)
+            self.email_listbox.insert(tk.END, f"{len(self.emails)}: {subject}")
+        self.root.after(POLL_MS, self.poll_queue)
+
     def display_email_content(self, event):
         selected_index = self.email_listbox.curselection()
         if not selected_index:
             return
         
         index = selected_index[0]
-        message = self.emails[index]
+        entry = self.emails[index]
         
         # Display headers
         headers = ""
-        for header, value in message.items():
+        for header, value in read_headers(self.trace_path, entry):
             headers += f"{header}: {value}\n"
         self.email_headers.config(state='normal')
         self.email_headers.delete(1.0, tk.END)
         self.email_headers.insert(tk.END, headers)
         self.email_headers.config(state='disabled')
         
-        # Display content as plain text
-        content = message.get_payload(decode=True)
-        if isinstance(content, bytes):
-            content = content.decode(errors='ignore')
-        
+        # Display content as plain text, decoded only now; long bodies
+        # (full test logs) a page at a time
+        self.body = read_body(self.trace_path, entry)
+        self.body_shown = 0
         self.email_content.config(state='normal')
         self.email_content.delete(1.0, tk.END)
-        self.email_content.insert(tk.END, content)
         self.email_content.config(state='disabled')
+        self.show_more_content()
 
-def main():
-    mbox_file = sys.argv[1] if len(sys.argv) == 2 else None
-    logging.basicConfig(level=logging.INFO)
+    def show_more_content(self):
+        end = min(len(self.body), self.body_shown + BODY_PAGE)
+        self.email_content.config(state='normal')
+        self.email_content.insert(tk.END, self.body[self.body_shown:end])
+        self.email_content.config(state='disabled')
+        self.body_shown = end
+        if self.body_shown < len(self.body):
+            self.more_button.config(state='normal', text=f"More ({len(self.body) - self.body_shown} characters left)")
+        else:
+            self.more_button.config(state='disabled', text="More")
+
+def search_main(args):
+    try:
+        regex = re.compile(args.regex, re.IGNORECASE if args.ignore_case else 0)
+    except re.error as e:
+        sys.stderr.write(f"Invalid regex {args.regex}: {e}\n")
+        return 2
+    found = 0
+    for path in args.traces or find_traces():
+        index = TraceIndex(path)
+        for number, entry in conversation(index, args.from_start):
+            lines = []
+            if not args.subject:
+                lines = [line for line in read_body(path, entry).splitlines() if regex.search(line)]
+            if len(lines) == 0 and not regex.search(entry['subject']):
+                continue
+            found += 1
+            print(f"{path}:{number}: {entry['subject']}")
+            for line in lines[:MAX_MATCH_LINES]:
+                print(f"    {line[:200]}")
+            if len(lines) > MAX_MATCH_LINES:
+                print(f"    ... {len(lines) - MAX_MATCH_LINES} more lines")
+    return 0 if found > 0 else 1
+
+def export_main(args):
+    out = sys.stdout if args.output is None else open(args.output, 'w')
+    try:
+        if args.html:
+            out.write("<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><style>"
+                      "pre { white-space: pre-wrap; } .headers { color: #666; }"
+                      "</style></head><body>\n")
+        for path in args.traces:
+            index = TraceIndex(path)
+            messages = conversation(index, args.from_start)
+            if len(args.message) > 0:
+                messages = [(number, entry) for number, entry in messages if number in args.message]
+            if args.html:
+                out.write(f"<h1>{html.escape(path)}</h1>\n")
+            else:
+                out.write(f"#### {path}\n\n")
+            for number, entry in messages:
+                headers = [(name, value) for name, value in read_headers(path, entry) if name in EXPORT_HEADERS]
+                body = read_body(path, entry)
+                if args.html:
+                    out.write(f"<h2>{number}: {html.escape(entry['subject'])}</h2>\n<div class=\"headers\">\n")
+                    for name, value in headers:
+                        out.write(f"{html.escape(name)}: {html.escape(str(value))}<br>\n")
+                    out.write(f"</div>\n<pre>{html.escape(body)}</pre>\n")
+                else:
+                    out.write(f"==== {number}: {entry['subject']} ====\n")
+                    for name, value in headers:
+                        out.write(f"{name}: {value}\n")
+                    out.write(f"\n{body.rstrip()}\n\n")
+        if args.html:
+            out.write("</body></html>\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+def cli_main(argv):
+    parser = argparse.ArgumentParser(prog='swe_mbox', description='Search and export traces without the GUI.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    search = subparsers.add_parser('search', help='Search subjects and bodies with a regex')
+    search.add_argument('regex', help='Python regex, matched against each line')
+    search.add_argument('traces', nargs='*', help='Traces to search; default all in the current directory')
+    search.add_argument('-i', '--ignore-case', action='store_true', help='Case insensitive')
+    search.add_argument('--subject', action='store_true', help='Search the subjects only')
+    search.add_argument('--all', dest='from_start', action='store_true', help='Also the messages before the last ticket')
+    export = subparsers.add_parser('export', help='Export conversations to text or HTML')
+    export.add_argument('traces', nargs='+', help='Traces to export')
+    export.add_argument('-m', '--message', type=int, action='append', default=[], help='Number of a message to export; can be repeated; default all')
+    export.add_argument('-o', '--output', default=None, help='Output file; default stdout')
+    export.add_argument('--html', action='store_true', help='Write HTML instead of text')
+    export.add_argument('--all', dest='from_start', action='store_true', help='Also the messages before the last ticket')
+    args = parser.parse_args(argv)
+    if args.command == 'search':
+        return search_main(args)
+    return export_main(args)
+
+def gui_main(mbox_file):
+    global tk, ttk
+    import tkinter as tk
+    from tkinter import ttk
     root = tk.Tk()
     app = EmailViewer(root, mbox_file)
     root.mainloop()
 
+def main():
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) > 1 and sys.argv[1] in ('search', 'export'):
+        return cli_main(sys.argv[1:])
+    mbox_file = sys.argv[1] if len(sys.argv) == 2 else None
+    gui_main(mbox_file)
+
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import threading
+import email.policy
+from email.parser import BytesHeaderParser
+from aa_swe.swe_trace import scan
+
+# Per-step metrics of a solve, written by swe_solve to metrics.jsonl next
+# to trace.mbox, one JSON object per line:
+#
+#     {"event": "setup", "t": ..., "container_seconds": ..., "solver_seconds": ..., "replay_seconds": ...}
+#     {"event": "command", "t": ..., "command": ..., "seconds": ..., "returncode": ...}
+#     {"event": "test", "t": ..., "fast": ..., "seconds": ..., "resolved": ..., "aborted": ...}
+#     {"event": "step", "t": ..., "step": ..., "seconds": ..., "shell_seconds": ...,
+#      "model_seconds": ..., "cost": ..., "cost_delta": ..., "tokens_in": ..., "tokens_out": ...,
+#      "max_input": ..., "messages": ...}
+#
+# A step is one call of the stop condition by the engine.  Its tokens are
+# those of the messages appended to the trace during the step; its shell
+# time is that of the commands run during the step, and the rest of the
+# step is counted as model time.  swe_stat aggregates these files.
+
+METRICS_NAME = 'metrics.jsonl'
+MAX_COMMAND_LENGTH = 200
+
+class TraceTail:
+    # Reads the index entries (see swe_trace) of the messages appended to
+    # an mbox since the last call, without re-reading the rest.
+
+    def __init__ (self, path):
+        self.path = path
+        self.offset = 0
+        self.parser = BytesHeaderParser(policy=email.policy.default)
+
+    def read (self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read()
+        # a message being written is read again next time
+        entries, consumed = scan(data, 0, len(data), self.parser)
+        self.offset += consumed
+        return entries
+
+class MetricsLog:
+    def __init__ (self, path, trace_path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.f = open(path, 'a')
+        self.tail = None if trace_path is None else TraceTail(trace_path)
+        self.steps = 0
+        self.last_step = time.time()
+        self.last_cost = 0.0
+        self.shell_seconds = 0.0        # since the last step
+
+    def write (self, event, **fields):
+        record = {'event': event, 't': time.time()}
+        record.update(fields)
+        with self.lock:
+            self.f.write(json.dumps(record) + '\n')
+            self.f.flush()
+
+    def command (self, command, seconds, returncode=None):
+        self.shell_seconds += seconds
+        self.write('command', command=command[:MAX_COMMAND_LENGTH], seconds=seconds, returncode=returncode)
+
+    def test (self, seconds, fast, resolved, aborted=False):
+        self.write('test', seconds=seconds, fast=fast, resolved=resolved, aborted=aborted)
+
+    def step (self, cost):
+        now = time.time()
+        seconds = now - self.last_step
+        tokens_in = tokens_out = max_input = messages = 0
+        if self.tail is not None:
+            for entry in self.tail.read():
+                messages += 1
+                tokens = entry['tokens_in'] or 0
+                tokens_in += tokens
+                max_input = max(max_input, tokens)
+                tokens_out += entry['tokens_out'] or 0
+        self.steps += 1
+        self.write('step', step=self.steps, seconds=seconds,
+                   shell_seconds=self.shell_seconds, model_seconds=max(0.0, seconds - self.shell_seconds),
+                   cost=cost, cost_delta=cost - self.last_cost,
+                   tokens_in=tokens_in, tokens_out=tokens_out, max_input=max_input, messages=messages)
+        self.last_step = now
+        self.last_cost = cost
+        self.shell_seconds = 0.0
+
+    def close (self):
+        self.f.close()
+
+def read_metrics (path):
+    records = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # the last line of a solve that was killed
+                continue
+    return records
+
+def summarize (records):
+    # Totals of one solve.
+    summary = {
+        'steps': 0, 'tokens_in': 0, 'tokens_out': 0, 'max_input': 0, 'cost': 0.0,
+        'wall_seconds': 0.0, 'model_seconds': 0.0, 'shell_seconds': 0.0,
+        'commands': 0, 'tests': 0, 'test_seconds': 0.0, 'setup_seconds': 0.0,
+    }
+    first = None
+    last = None
+    for record in records:
+        t = record.get('t', None)
+        if t is not None:
+            first = t if first is None else min(first, t)
+            last = t if last is None else max(last, t)
+        event = record.get('event', None)
+        if event == 'step':
+            summary['steps'] += 1
+            summary['tokens_in'] += record['tokens_in']
+            summary['tokens_out'] += record['tokens_out']
+            summary['max_input'] = max(summary['max_input'], record['max_input'])
+            summary['cost'] = max(summary['cost'], record['cost'])
+            summary['model_seconds'] += record['model_seconds']
+            summary['shell_seconds'] += record['shell_seconds']
+        elif event == 'command':
+            summary['commands'] += 1
+        elif event == 'test':
+            summary['tests'] += 1
+            summary['test_seconds'] += record['seconds']
+        elif event == 'setup':
+            summary['setup_seconds'] += sum(v for k, v in record.items() if k.endswith('_seconds'))
+    if first is not None:
+        summary['wall_seconds'] = last - first
+    return summary
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import datetime
+import argparse
+import subprocess as sp
+
+# Warm container pool.
+#
+# Starting a container for a solve is slow: the entrypoint shell_stub.sh
+# installs aa_swe and runs aa_init before the stub starts listening.  The
+# pool pre-starts containers so that a solve can claim one that is
+# already past that point.
+#
+# Layout of the pool directory (by default .pool under the directory
+# where swe_solve runs):
+#
+#     .pool/<image>/<container name>/               mounted as /output
+#     .pool/<image>/<container name>/container.json present once ready
+#
+# A solve claims a container by renaming its slot directory to the solve's
+# output directory.  The rename is atomic so two solves never get the
+# same container, and the bind mount follows the directory, so the index
+# and state built by aa_init during warm up come along.  Because of the
+# rename, the pool directory must be on the same filesystem as the output
+# directories.  Used containers are not reused; they are killed and the
+# pool is refilled with fresh ones.
+
+STUB_PORT = 8642
+DEFAULT_POOL_DIR = '.pool'
+CONTAINER_INFO = 'container.json'
+READY_FILE = 'ready'
+READY_POLL_INTERVAL = 0.05
+PROBE_FIRST_DELAY = 0.01
+PROBE_MAX_DELAY = 1.0
+ALIVE_CHECK_INTERVAL = 10
+
+class DockerBackend:
+    # Runs containers with the docker CLI.
+
+    def __init__ (self):
+        import mailcoach
+        stub_path = os.path.join(os.path.dirname(mailcoach.__file__), "shell_stub.py")
+        self.stub_path = os.path.abspath(stub_path)
+        assert os.path.exists(self.stub_path), f"shell_stub.py not found at {self.stub_path}"
+        self.aa_swe_path = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+
+    def image_exists (self, image):
+        result = sp.run(f"docker image inspect {image}:latest >/dev/null 2>&1", shell=True)
+        return result.returncode == 0
+
+    def start (self, image, name, output_dir, detach=True):
+        # Returns the Popen handle of the docker client when not detached.
+        command = ["docker", "run", "--rm"]
+        if detach:
+            command.append("-d")
+        command.extend(["-v", f"{self.stub_path}:/shell_stub.py",
+                        "-v", f"{self.aa_swe_path}:/aa_swe",
+                        "-v", f"{os.path.abspath(output_dir)}:/output",
+                        "--name", name,
+                        image,
+                        "/aa_swe/aa_swe/shell_stub.sh"
+                        ])
+        if detach:
+            sp.run(command, stdout=sp.DEVNULL, check=True)
+            return None
+        return sp.Popen(command)
+
+    def get_ip (self, name):
+        try:
+            ip = sp.check_output(["docker", "inspect", "-f", "{{range .NetworkSettings.Networks}}{{.IPAddress}}{{end}}", name], stderr=sp.DEVNULL).decode('ascii').strip()
+        except sp.CalledProcessError:
+            return None
+        return ip or None
+
+    def probe (self, ip):
+        # The stub is the last thing the entrypoint starts, so once it
+        # accepts connections the container is ready.
+        try:
+            with socket.create_connection((ip, STUB_PORT), timeout=1):
+                return True
+        except OSError:
+            return False
+
+    def is_running (self, name):
+        try:
+            out = sp.check_output(["docker", "inspect", "-f", "{{.State.Running}}", name], stderr=sp.DEVNULL)
+        except sp.CalledProcessError:
+            return False
+        return out.decode('ascii').strip() == 'true'
+
+    def kill (self, name):
+        sp.run(["docker", "kill", name], stdout=sp.DEVNULL, stderr=sp.DEVNULL)
+
+    def commit (self, name, image):
+        # Snapshots the filesystem of a running container as image.
+        return sp.run(["docker", "commit", name, image], stdout=sp.DEVNULL, stderr=sp.DEVNULL).returncode == 0
+
+    def remove_image (self, image):
+        sp.run(["docker", "rmi", image], stdout=sp.DEVNULL, stderr=sp.DEVNULL)
+
+class FakeBackend:
+    # An in-memory stand-in for DockerBackend, for exercising the pool
+    # without a docker daemon.  Containers announce themselves right away
+    # and accept connections after ready_after probes.
+
+    def __init__ (self, images=None, ready_after=0):
+        self.images = None if images is None else set(images)
+        self.ready_after = ready_after
+        self.containers = {}    # name -> {'image', 'output_dir', 'ip', 'probes', 'running'}
+        self.started = []
+        self.killed = []
+
+    def image_exists (self, image):
+        return self.images is None or image in self.images
+
+    def start (self, image, name, output_dir, detach=True):
+        assert name not in self.containers, f"container {name} already exists"
+        ip = f"10.0.{len(self.started) // 250}.{len(self.started) % 250 + 2}"
+        self.containers[name] = {'image': image, 'output_dir': output_dir, 'ip': ip, 'probes': 0, 'running': True}
+        self.started.append(name)
+        with open(os.path.join(output_dir, READY_FILE), 'w') as f:
+            f.write(ip + '\n')
+        return None
+
+    def get_ip (self, name):
+        container = self.containers.get(name, None)
+        if container is None or not container['running']:
+            return None
+        return container['ip']
+
+    def probe (self, ip):
+        for container in self.containers.values():
+            if container['ip'] != ip or not container['running']:
+                continue
+            if container['probes'] < self.ready_after:
+                container['probes'] += 1
+                return False
+            return True
+        return False
+
+    def is_running (self, name):
+        container = self.containers.get(name, None)
+        return container is not None and container['running']
+
+    def kill (self, name):
+        container = self.containers.get(name, None)
+        if container is not None and container['running']:
+            container['running'] = False
+            self.killed.append(name)
+
+    def commit (self, name, image):
+        if not self.is_running(name):
+            return False
+        if self.images is not None:
+            self.images.add(image)
+        return True
+
+    def remove_image (self, image):
+        if self.images is not None:
+            self.images.discard(image)
+
+def wait_ready (backend, name, output_dir, timeout=300, alive=None):
+    # Wait for the container to announce itself, then for the stub to
+    # accept connections.  Returns (ip, seconds), ip being None on failure.
+    #
+    # shell_stub.sh writes READY_FILE (with the container IP) to /output
+    # once setup is done, right before starting the stub.  Checking for the
+    # file is a stat, so it is polled at a short fixed interval; the stub
+    # is then probed with exponential backoff from PROBE_FIRST_DELAY.
+    begin = time.time()
+    ready_path = os.path.join(output_dir, READY_FILE)
+    ip = None
+    delay = PROBE_FIRST_DELAY
+    last_alive_check = begin
+    while time.time() - begin < timeout:
+        if ip is None:
+            if os.path.exists(ready_path):
+                with open(ready_path, 'r') as f:
+                    ip = f.read().strip()
+                if not ip:
+                    # hostname -i not available in the image
+                    ip = backend.get_ip(name)
+            else:
+                now = time.time()
+                if alive is not None and now - last_alive_check > ALIVE_CHECK_INTERVAL:
+                    last_alive_check = now
+                    if not alive():
+                        break
+                time.sleep(READY_POLL_INTERVAL)
+                continue
+        if ip is not None and backend.probe(ip):
+            return ip, time.time() - begin
+        time.sleep(delay)
+        delay = min(delay * 2, PROBE_MAX_DELAY)
+    return None, time.time() - begin
+
+class ContainerPool:
+    def __init__ (self, pool_dir=DEFAULT_POOL_DIR, backend=None):
+        self.pool_dir = os.path.abspath(pool_dir)
+        self.backend = DockerBackend() if backend is None else backend
+        self.counter = 0
+
+    def image_dir (self, image):
+        return os.path.join(self.pool_dir, image)
+
+    def slots (self, image):
+        # Returns (name, path, ready) for every slot of the image.
+        image_dir = self.image_dir(image)
+        if not os.path.isdir(image_dir):
+            return []
+        slots = []
+        for name in sorted(os.listdir(image_dir)):
+            path = os.path.join(image_dir, name)
+            slots.append((name, path, os.path.exists(os.path.join(path, CONTAINER_INFO))))
+        return slots
+
+    def images (self):
+        if not os.path.isdir(self.pool_dir):
+            return []
+        return sorted(os.listdir(self.pool_dir))
+
+    def new_name (self, image):
+        self.counter += 1
+        timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+        return f"{image}.pool.{timestamp}.{os.getpid()}.{self.counter}"
+
+    def fill (self, image, size, timeout=300):
+        # Start containers until the image has size slots, and wait for
+        # the new ones to become ready.  Returns the names started.
+        if not self.backend.image_exists(image):
+            sys.stderr.write(f"Docker image {image}:latest does not exist, not pooling\n")
+            return []
+        live = 0
+        for name, path, ready in self.slots(image):
+            if self.backend.is_running(name):
+                live += 1
+            elif ready:
+                # died while waiting in the pool
+                sys.stderr.write(f"Pooled container {name} is gone, discarding\n")
+                self.discard(name, path)
+        missing = size - live
+        started = []
+        for _ in range(missing):
+            name = self.new_name(image)
+            path = os.path.join(self.image_dir(image), name)
+            os.makedirs(path)
+            self.backend.start(image, name, path)
+            started.append((name, path, time.time()))
+        for name, path, start_time in started:
+            ip, _ = wait_ready(self.backend, name, path, timeout, alive=lambda: self.backend.is_running(name))
+            if ip is None:
+                sys.stderr.write(f"Pooled container {name} failed to start, discarding\n")
+                self.discard(name, path)
+                continue
+            info = {'name': name, 'image': image, 'ip': ip, 'ready': time.time(), 'ready_seconds': time.time() - start_time}
+            with open(os.path.join(path, CONTAINER_INFO + '.tmp'), 'w') as f:
+                json.dump(info, f)
+            os.rename(os.path.join(path, CONTAINER_INFO + '.tmp'), os.path.join(path, CONTAINER_INFO))
+        return [name for name, _, _ in started]
+
+    def claim (self, image, output_dir):
+        # Move a ready container's slot to output_dir, which must not exist
+        # yet.  Returns the container info, or None if none is available.
+        output_dir = os.path.abspath(output_dir)
+        for name, path, ready in self.slots(image):
+            if not ready:
+                continue
+            try:
+                os.rename(path, output_dir)
+            except OSError:
+                # claimed by someone else, or on another filesystem
+                continue
+            with open(os.path.join(output_dir, CONTAINER_INFO), 'r') as f:
+                info = json.load(f)
+            os.remove(os.path.join(output_dir, CONTAINER_INFO))
+            if not self.backend.is_running(info['name']):
+                # died while waiting in the pool; try the next one
+                self.discard(info['name'], output_dir)
+                continue
+            return info
+        return None
+
+    def discard (self, name, path):
+        self.backend.kill(name)
+        shutil.rmtree(path, ignore_errors=True)
+
+    def release (self, info):
+        self.backend.kill(info['name'])
+
+    def drain (self, image=None):
+        images = self.images() if image is None else [image]
+        for image in images:
+            for name, path, _ in self.slots(image):
+                self.backend.kill(name)
+                shutil.rmtree(path, ignore_errors=True)
+
+def main ():
+    parser = argparse.ArgumentParser(description='Manage the pool of warm containers.')
+    parser.add_argument('action', choices=['fill', 'watch', 'drain', 'status'], help='fill: start containers; watch: keep the pool filled; drain: kill all pooled containers')
+    parser.add_argument('-i', '--instance', nargs='*', default=[], help='Instance IDs to pool containers for')
+    parser.add_argument('-n', '--size', type=int, default=1, help='Number of warm containers per instance')
+    parser.add_argument('--pool', default=DEFAULT_POOL_DIR, help='The pool directory')
+    parser.add_argument('--interval', type=float, default=10, help='Seconds between refills in watch mode')
+    args = parser.parse_args()
+
+    pool = ContainerPool(args.pool)
+    images = [f"aa_swe.{instance_id}" for instance_id in args.instance]
+    if args.action == 'drain':
+        if len(images) == 0:
+            pool.drain()
+        for image in images:
+            pool.drain(image)
+        return
+    if args.action == 'status':
+        for image in pool.images():
+            slots = pool.slots(image)
+            ready = sum(1 for _, _, r in slots if r)
+            print(f"{image}: {ready} ready, {len(slots) - ready} starting")
+        return
+    while True:
+        for image in images:
+            started = pool.fill(image, args.size)
+            if len(started) > 0:
+                print(f"{image}: started {len(started)} containers")
+        if args.action == 'fill':
+            break
+        time.sleep(args.interval)
+
+if __name__ == "__main__":
+    main()
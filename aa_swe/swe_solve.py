@@ -1,9 +1,15 @@
 import sys
 import os
 import time
+import signal
 import datetime
 import subprocess as sp
 import json
+import email
+import email.policy
+import pickle
+import hashlib
+import mailbox
 import mailcoach
 import logging
 import argparse
@@ -19,75 +25,113 @@ from swebench.harness.constants import (
     EvalType,
     ResolvedStatus,
 )
-from aa_swe.swe import ROOT, load_instance
-STUB_PORT = 8642
+from aa_swe.swe import ROOT, load_instance, has_result
+from aa_swe.swe_pool import DockerBackend, ContainerPool, wait_ready, STUB_PORT, READY_FILE, DEFAULT_POOL_DIR
+from aa_swe.aa_test import FAST_TESTS_NAME
+from aa_swe.swe_eval import evaluate
+from aa_swe.swe_metrics import MetricsLog, METRICS_NAME
+from aa_swe.swe_catalog import record_attempt
 
 
 class DockerShell (Shell):
     # This class creates and maintains a working directory for the
     # instance and runs the docker shell on it.
 
-    def __init__ (self, address, instance_id, output_dir, timestamp, max_trials=5):
+    def __init__ (self, address, instance_id, output_dir, timestamp, max_trials=5, pool=None, container=None, early_abort=False, image=None, metrics=None):
         # address: robot address
         # instance_id: instance ID
-        self.docker_image = f"aa_swe.{instance_id}"
+        # pool: ContainerPool the container was claimed from, if any
+        # container: info of the container claimed from the pool
+        # early_abort: run aa_test with --abort-early
+        # image: docker image to run instead of aa_swe.<instance_id>, e.g. a
+        #        checkpoint made by swe_fork
+        # metrics: MetricsLog to record command and test times in
+        self.docker_image = f"aa_swe.{instance_id}" if image is None else image
         self.container_name = f"{instance_id}-{timestamp}"
         self.max_trials = max_trials
+        self.early_abort = early_abort
+        self.metrics = metrics
+        self.last_result = None
         self.trials = 0
+        self.fast_trials = 0        # aa_test --fast runs, not limited by max_trials
         self.output_dir = os.path.abspath(output_dir)
-
-        result = sp.run(f"docker image inspect {self.docker_image}:latest >/dev/null 2>&1", shell=True)
-        if result.returncode != 0:
-            print(f"Docker image {self.docker_image}:latest does not exist. Rebuilding")
-            os.system(f"swe_build_docker -i {instance_id}")
+        self.pool = pool
+        self.backend = DockerBackend() if pool is None else pool.backend
+        self.handle = None
 
         instance = load_instance(instance_id)
         self.instance = instance
+        self.spec = None            # TestSpec, made on the first test run
         with open(os.path.join(self.output_dir, "instance.json"), "w") as f:
             json.dump(instance, f)
-        stub_path = os.path.join(os.path.dirname(mailcoach.__file__), "shell_stub.py")
-        stub_path = os.path.abspath(stub_path)
-        assert os.path.exists(stub_path), f"shell_stub.py not found at {stub_path}"
-        aa_swe_path = os.path.dirname(os.path.dirname(__file__))
-        aa_swe_path = os.path.abspath(aa_swe_path)
-
-        command = ["docker", "run", "--rm",
-                    "-v", f"{stub_path}:/shell_stub.py",
-                    "-v", f"{aa_swe_path}:/aa_swe",
-                    "-v", f"{self.output_dir}:/output",
-                    "--name", self.container_name,
-                    self.docker_image,
-                    "/aa_swe/aa_swe/shell_stub.sh"
-                    ]
-        self.handle = sp.Popen(command)
-        self.container_ip = None
-        for i in range(150):
-            try:
-                if self.container_ip is None:
-                    self.container_ip = sp.check_output("docker inspect -f '{{range .NetworkSettings.Networks}}{{.IPAddress}}{{end}}' " + self.container_name + " 2>/dev/null", shell=True).decode('ascii').strip()
-                    super().__init__(address, f"http://{self.container_ip}:{STUB_PORT}")
-                print("Container IP is", self.container_ip)
-                out = self.run_remote_command("true", None)
-                break
-            except:
-                pass
-            print(f"Waiting for container ({self.container_ip}) to start...")
-            time.sleep(2)
+
+        if container is not None:
+            self.container_name = container['name']
+            self.container_ip = container['ip']
+            # the startup cost was paid by the pool, before the claim
+            self.ready_seconds = 0
+            super().__init__(address, f"http://{self.container_ip}:{STUB_PORT}")
+            logging.info(f"container ready: image={self.docker_image} seconds=0.000 pooled=1 warmup={container.get('ready_seconds', 0):.3f}")
+            print(f"Using pooled container {self.container_name} at http://{self.container_ip}:{STUB_PORT}")
+            return
+
+        if not self.backend.image_exists(self.docker_image):
+            assert image is None, f"Docker image {image} does not exist"
+            print(f"Docker image {self.docker_image}:latest does not exist. Rebuilding")
+            os.system(f"swe_build_docker -i {instance_id}")
+
+        ready_path = os.path.join(self.output_dir, READY_FILE)
+        if os.path.exists(ready_path):
+            # left over by a dead pooled container
+            os.remove(ready_path)
+        self.handle = self.backend.start(self.docker_image, self.container_name, self.output_dir, detach=False)
+        print(f"Waiting for container {self.container_name} to start...")
+        self.container_ip, self.ready_seconds = wait_ready(self.backend, self.container_name, self.output_dir, alive=lambda: self.handle.poll() is None)
         assert self.container_ip is not None, f"Failed to start container {self.docker_image} as {self.container_name}"
+        super().__init__(address, f"http://{self.container_ip}:{STUB_PORT}")
+        logging.info(f"container ready: image={self.docker_image} seconds={self.ready_seconds:.3f} pooled=0")
         print(f"Docker stub has started at http://{self.container_ip}:{STUB_PORT}")
 
     def shutdown (self):
-        os.system(f"docker kill {self.container_name}")
-        self.handle.wait()
-        self.handle = None
+        if self.handle is None and self.pool is not None:
+            self.pool.release({'name': self.container_name})
+        else:
+            self.backend.kill(self.container_name)
+        if self.handle is not None:
+            self.handle.wait()
+            self.handle = None
 
-    def handle_test_output (self, output):
+    def grade (self, output, selected=None):
+        if self.spec is None:
+            self.spec = make_test_spec(self.instance)
+        return evaluate(self.spec, output, selected)
+
+    def handle_test_output (self, output, fast=False):
+        if fast:
+            # graded on the tests aa_test --fast selected, never writes the patch
+            stdout_path = os.path.join(self.output_dir, f"stdout.fast.{self.fast_trials}")
+            self.fast_trials += 1
+            with open(stdout_path, "w") as f:
+                f.write(output)
+            # aa_test removes the selection before a fast run and writes it
+            # when the run is prepared; it is missing if aa_test did not
+            # get that far (bad arguments, the _aa_test hook, an error)
+            selected_path = os.path.join(self.output_dir, FAST_TESTS_NAME)
+            if not os.path.exists(selected_path):
+                self.last_result = None
+                return output + f"\naa_test --fast did not select any tests ({FAST_TESTS_NAME} not written); the run was not graded.\n"
+            with open(selected_path, "r") as f:
+                selected = json.load(f)
+            self.last_result = self.grade(output, selected)
+            return self.last_result.format()
         stdout_path = os.path.join(self.output_dir, f"stdout.{self.trials}")
         self.trials += 1
         with open(stdout_path, "w") as f:
             f.write(output)
-        output = sp.check_output(f"swe_eval {stdout_path} 2> /dev/null", shell=True).decode('utf-8')
-        success = 'Congratulations!' in output
+        result = self.grade(output)
+        self.last_result = result
+        output = result.format()
+        success = result.resolved
         if success:
             self.run_remote_command('cd /testbed && git diff > /output/patch', None)
             assert os.path.exists(os.path.join(self.output_dir, "patch")), f"Patch file not found at {os.path.join(self.output_dir, 'patch')}"
@@ -97,11 +141,69 @@ class DockerShell (Shell):
         return output
 
     def run_remote_command (self, command, timeout=None):
+        words = command.split()
+        # only plain aa_test with options, not piped or combined commands
+        is_test = len(words) > 0 and words[0] == 'aa_test' and all(word.startswith('-') or word.isdigit() for word in words[1:])
+        if is_test and self.early_abort and '--abort-early' not in words:
+            command = command.rstrip() + ' --abort-early'
+        begin = time.time()
         resp = super().run_remote_command(command, timeout)
-        if command.strip() == 'aa_test':
-            resp.stdout = self.handle_test_output(resp.stdout)
+        seconds = time.time() - begin
+        if is_test:
+            resp.stdout = self.handle_test_output(resp.stdout, fast='--fast' in words)
+        if self.metrics is not None:
+            self.metrics.command(command, seconds, resp.returncode)
+            if is_test and self.last_result is not None:
+                self.metrics.test(seconds, '--fast' in words, self.last_result.resolved, self.last_result.aborted is not None)
         return resp
 
+SOLVER_CACHE_DIR = '.solver_cache'      # next to the solver
+
+def solver_cache_path (solver_path):
+    # The cache of a solver is keyed by the sha1 of its content.
+    with open(solver_path, 'rb') as f:
+        key = hashlib.sha1(f.read()).hexdigest()
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(solver_path)), SOLVER_CACHE_DIR)
+    return os.path.join(cache_dir, f"{key}.pkl")
+
+def load_solver_memory (engine, solver_path):
+    # Enqueues the messages of the solver as memory.
+    #
+    # Without a cache, the solver is loaded by engine.load_mbox, which is
+    # timed, and the parsed messages are then cached with that time.  With
+    # the cache, the cached messages are enqueued as engine.load_mbox does,
+    # and the time saved is measured against the uncached load of the same
+    # solver.  Returns (cached, seconds, seconds saved).
+    begin = time.time()
+    cache_path = solver_cache_path(solver_path)
+    cached = None
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                cached = pickle.load(f)
+        except Exception as e:
+            logging.warning(f"ignoring broken solver cache {cache_path}: {e}")
+    if cached is not None:
+        for message in cached['messages']:
+            engine.enqueue(message, ENQUEUE_MEMORY)
+        seconds = time.time() - begin
+        return True, seconds, max(0.0, cached['load_seconds'] - seconds)
+    begin = time.time()
+    engine.load_mbox(solver_path, ENQUEUE_MEMORY)
+    seconds = time.time() - begin
+    factory = lambda f: email.message_from_binary_file(f, policy=email.policy.default)
+    messages = list(mailbox.mbox(solver_path, factory=factory, create=False))
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # concurrent solves may write the same cache; the rename is atomic
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'messages': messages, 'load_seconds': seconds}, f)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logging.warning(f"cannot write solver cache {cache_path}: {e}")
+    return False, seconds, 0.0
+
 def shell_main ():
     import argparse
     parser = argparse.ArgumentParser(description='Test docker shell')
@@ -135,7 +237,6 @@ def main ():
     if os.path.exists("quit"):
         print("Found quit file, not solving")
         return
-    from glob import glob
     parser = argparse.ArgumentParser(description='Process an mbox file.')
     parser.add_argument('-s', '--solver', default='solver.mbox', help='Path to solver memory.')
     parser.add_argument('-i', '--instance', type=str, required=True, help='The instance ID to process')
@@ -145,91 +246,181 @@ def main ():
     parser.add_argument('-f', '--force', action='store_true', help='Force the operation to run even if conditions are not met')
     parser.add_argument('--max_trials', type=int, default=8, help='The maximum number of trials allowed')
     parser.add_argument('--team', action='store_true', help='Team mode')
+    parser.add_argument('--pool', nargs='?', const=DEFAULT_POOL_DIR, default=None, help='Claim a warm container from the pool (see swe_pool)')
+    parser.add_argument('--early_abort', action='store_true', help='Stop test runs at the first failing FAIL_TO_PASS test')
+    parser.add_argument('--image', default=None, help='Docker image to run instead of aa_swe.INSTANCE (see swe_fork)')
+    parser.add_argument('--output_dir', default=None, help='Output directory instead of INSTANCE.TIMESTAMP; may exist')
+    parser.add_argument('--no_solver_cache', action='store_true', help='Load the solver with engine.load_mbox, without the cache')
     args = parser.parse_args()
     if not os.path.exists(args.solver):
         print(f"Solver {args.solver} not found.")
         return
-    patches = list(glob(os.path.join(args.instance + '.*', "patch")))
-    failures = list(glob(os.path.join(args.instance + '.*', "failed")))
-    if len(patches) + len(failures) > 0:
+    if has_result(args.instance):
         if not args.force:
             sys.stderr.write(f"Work directories already exist, not solving\n")
             return
 
+    start_time = time.time()
     timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
     output_dir = f"{args.instance}.{timestamp}"
-    os.makedirs(output_dir, exist_ok=False)
+    if args.output_dir is not None:
+        output_dir = args.output_dir
+        # the container is named after the output directory, which is unique
+        timestamp = os.path.basename(os.path.abspath(output_dir))
+        if timestamp.startswith(args.instance + '.'):
+            timestamp = timestamp[len(args.instance) + 1:]
     trace_path = f"{output_dir}/trace.mbox"
     log_path = f"{output_dir}/log.txt"
     patch_path = f"{output_dir}/patch"
     failed_path = f"{output_dir}/failed"
-    # Set up logging to file
-    logging.root.handlers = []
-    logging.basicConfig(level=logging.INFO,
-                        format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
-                        datefmt='%m-%d %H:%M',
-                        handlers=[
-                            logging.FileHandler(log_path),
-                            logging.StreamHandler(sys.stdout)
-                        ])
-    logging.info("Logging setup complete. Log file path: %s", log_path)
-
-    engine = Engine(trace_path=trace_path, allow_new_agents=True)
-    shell = DockerShell("shell@localdomain", args.instance, output_dir, timestamp)
-    engine.register(shell)
-    pm = Agent("user@localdomain", default_model=args.model)
-    swe = Agent("swe@localdomain", default_model=args.model)
-    engine.register(pm)
-    engine.register(swe)
-    engine.load_mbox(args.solver, ENQUEUE_MEMORY)
-    engine.run()
-    pm.model = args.model
-    swe.model = args.model
-
-    def stop_condition (cost):
-        if os.path.exists(patch_path):
-            logging.info(f"A patch was found; solver seems to have succeeded.")
-            return True
-        if os.path.exists(failed_path):
-            logging.info(f"Solver has failed.")
-            return True
-        if cost > args.budget:
-            logging.info(f"Reaching budget {cost:.8f} > {args.budget:.8f}.")
-            return True
-        return False
-
-    message = EmailMessage()
-    if args.team:
-        adviser = engine.entities.get("adviser@localdomain", None)
-        inv_swe = engine.entities.get("inv.swe@localdomain", None)
-        test_swe = engine.entities.get("test.swe@localdomain", None)
-        assert not inv_swe is None and not test_swe is None and not adviser is None
-        adviser.model = 'openai/gpt-4o'
-        inv_swe.model = args.model
-        test_swe.model = args.model
-        # but do not register them; or they won't be cloned
-        message1 = EmailMessage()
-        message1["From"] = pm.address
-        message1["To"] = swe.address
-        message1["X-Expect"] = f"{test_swe.address}, {inv_swe.address}"
-        message1["X-Drop"] = "true"
-        message1.set_content("")
-        engine.enqueue(message1, ENQUEUE_TASK)
-
-        message["To"] = f"{test_swe.address}, {inv_swe.address}, {swe.address}"
-        message["Cc"] = f"{adviser.address}"
-    else:
-        message["To"] = swe.address
-    message["From"] = pm.address
-    message["Subject"] = f"New ticket: {args.instance}"
-    message["X-Hint-Model"] = args.model
-    content = "We are now in a new codebase.  Below is the description of the ticket we need to solve.\n--- ticket ---\n"
-    content += shell.instance['problem_statement']
-    message.set_content(content)
-    engine.enqueue(message, ENQUEUE_TASK)
-    engine.run(stop_condition=stop_condition, debug=args.debug)
-    if not os.path.exists(patch_path):
+    summary_path = f"{output_dir}/summary.json"
+
+    # swe_fork cancels solves with SIGTERM; exit through the finally below,
+    # so the container is shut down and the attempt is recorded as
+    # cancelled.  Installed before any container is claimed or started.
+    cancelled = [False]
+    def on_sigterm (signum, frame):
+        cancelled[0] = True
+        sys.exit(128 + signum)
+    signal.signal(signal.SIGTERM, on_sigterm)
+    pool = None
+    container = None
+    shell = None
+    metrics = None
+    last_cost = [0.0]
+    try:
+        if args.pool is not None:
+            pool = ContainerPool(args.pool)
+            # claiming moves the pooled container's directory to output_dir
+            container = pool.claim(args.image or f"aa_swe.{args.instance}", output_dir)
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir, exist_ok=False)
+        # Set up logging to file
+        logging.root.handlers = []
+        logging.basicConfig(level=logging.INFO,
+                            format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+                            datefmt='%m-%d %H:%M',
+                            handlers=[
+                                logging.FileHandler(log_path),
+                                logging.StreamHandler(sys.stdout)
+                            ])
+        logging.info("Logging setup complete. Log file path: %s", log_path)
+
+        engine = Engine(trace_path=trace_path, allow_new_agents=True)
+        metrics = MetricsLog(os.path.join(output_dir, METRICS_NAME), trace_path)
+        shell = DockerShell("shell@localdomain", args.instance, output_dir, timestamp, pool=pool, container=container, early_abort=args.early_abort, image=args.image, metrics=metrics)
+        record_attempt(output_dir, instance_id=args.instance, split=shell.instance.get('split', None),
+                       model=args.model, started=start_time)
+        if container is not None:
+            logging.info(f"Claimed pooled container {container['name']}")
+        engine.register(shell)
+        pm = Agent("user@localdomain", default_model=args.model)
+        swe = Agent("swe@localdomain", default_model=args.model)
+        engine.register(pm)
+        engine.register(swe)
+        if args.no_solver_cache:
+            begin = time.time()
+            engine.load_mbox(args.solver, ENQUEUE_MEMORY)
+            solver_seconds = time.time() - begin
+            logging.info(f"solver loaded: cached=0 seconds={solver_seconds:.3f}")
+        else:
+            hit, solver_seconds, saved = load_solver_memory(engine, args.solver)
+            logging.info(f"solver loaded: cached={int(hit)} seconds={solver_seconds:.3f} saved={saved:.3f}")
+        begin = time.time()
+        engine.run()
+        replay_seconds = time.time() - begin
+        logging.info(f"solver memory replayed: seconds={replay_seconds:.3f}")
+        metrics.write('setup', container_seconds=shell.ready_seconds, solver_seconds=solver_seconds, replay_seconds=replay_seconds)
+        # the memory replay is not part of the first step
+        metrics.tail.read()
+        metrics.last_step = time.time()
+        pm.model = args.model
+        swe.model = args.model
+
+        def stop_condition (cost):
+            last_cost[0] = cost
+            metrics.step(cost)
+            if os.path.exists(patch_path):
+                logging.info(f"A patch was found; solver seems to have succeeded.")
+                return True
+            if os.path.exists(failed_path):
+                logging.info(f"Solver has failed.")
+                return True
+            if cost > args.budget:
+                logging.info(f"Reaching budget {cost:.8f} > {args.budget:.8f}.")
+                return True
+            return False
+
+        message = EmailMessage()
+        if args.team:
+            adviser = engine.entities.get("adviser@localdomain", None)
+            inv_swe = engine.entities.get("inv.swe@localdomain", None)
+            test_swe = engine.entities.get("test.swe@localdomain", None)
+            assert not inv_swe is None and not test_swe is None and not adviser is None
+            adviser.model = 'openai/gpt-4o'
+            inv_swe.model = args.model
+            test_swe.model = args.model
+            # but do not register them; or they won't be cloned
+            message1 = EmailMessage()
+            message1["From"] = pm.address
+            message1["To"] = swe.address
+            message1["X-Expect"] = f"{test_swe.address}, {inv_swe.address}"
+            message1["X-Drop"] = "true"
+            message1.set_content("")
+            engine.enqueue(message1, ENQUEUE_TASK)
+
+            message["To"] = f"{test_swe.address}, {inv_swe.address}, {swe.address}"
+            message["Cc"] = f"{adviser.address}"
+        else:
+            message["To"] = swe.address
+        message["From"] = pm.address
+        message["Subject"] = f"New ticket: {args.instance}"
+        message["X-Hint-Model"] = args.model
+        content = "We are now in a new codebase.  Below is the description of the ticket we need to solve.\n--- ticket ---\n"
+        content += shell.instance['problem_statement']
+        message.set_content(content)
+        engine.enqueue(message, ENQUEUE_TASK)
+        engine.run(stop_condition=stop_condition, debug=args.debug)
+    except SystemExit:
+        if not cancelled[0]:
+            raise
+        logging.info(f"Solve cancelled.")
+    finally:
+        # a late SIGTERM must not cut the shutdown and bookkeeping short
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        if shell is not None:
+            shell.shutdown()
+        elif container is not None:
+            pool.release(container)
+        elif cancelled[0]:
+            # cancelled while the container was starting
+            DockerBackend().kill(f"{args.instance}-{timestamp}")
+        if metrics is not None:
+            metrics.close()
+    if cancelled[0] and not os.path.exists(output_dir):
+        # cancelled before the attempt had a directory
+        sys.exit(128 + signal.SIGTERM)
+    outcome = 'failed'
+    if os.path.exists(patch_path):
+        outcome = 'solved'
+    elif cancelled[0]:
+        outcome = 'cancelled'
+    if outcome == 'failed':
         logging.info(f"No patch was found; solver has failed.")
+    if outcome != 'solved':
         if not os.path.exists(failed_path):
             with open(failed_path, "w") as f:
-                f.write('test not run')
\ No newline at end of file
+                f.write('cancelled' if cancelled[0] else 'test not run')
+    summary = {
+        'instance_id': args.instance,
+        'outcome': outcome,
+        'wall_time': time.time() - start_time,
+        'cost': last_cost[0],
+        'trials': 0 if shell is None else shell.trials,
+        'model': args.model,
+    }
+    with open(summary_path, "w") as f:
+        json.dump(summary, f)
+    record_attempt(output_dir, finished=time.time(), **summary)
+    if cancelled[0]:
+        sys.exit(128 + signal.SIGTERM)
\ No newline at end of file
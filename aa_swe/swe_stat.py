@@ -1,8 +1,70 @@
 #!/usr/bin/env python3
+import os
+import argparse
 from glob import glob
-import mailbox
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
+from aa_swe.swe_trace import TraceIndex
+from aa_swe.swe_metrics import METRICS_NAME, read_metrics, summarize
+
+# Records are extracted from the traces (or metrics files) in a process
+# pool and cached in CSVs in the current directory, one row per file with
+# its size and mtime, so a run only reads the files that are new or have
+# changed since the last one.
+
+METRICS_CACHE = '.swe_stat.metrics.csv'
+TRACES_CACHE = '.swe_stat.traces.csv'
+CHUNK_SIZE = 4
+
+def file_key (path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+def load_records (cache_path):
+    # {path: (size, mtime_ns, record or None)}
+    cached = {}
+    if not os.path.exists(cache_path):
+        return cached
+    df = pd.read_csv(cache_path)
+    columns = [c for c in df.columns if c not in ('path', 'size', 'mtime_ns')]
+    for row in df.to_dict('records'):
+        record = {c: row[c] for c in columns if not pd.isna(row[c])}
+        cached[row['path']] = (row['size'], row['mtime_ns'], record if len(record) > 0 else None)
+    return cached
+
+def collect (paths, extract, cache_path, jobs=None):
+    # {path: extract(path)}, extract returning a flat dict or None.
+    # extract must be a module level function to run in the pool.
+    cached = load_records(cache_path)
+    keys = {path: file_key(path) for path in paths}
+    records = {}
+    todo = []
+    for path in paths:
+        size, mtime_ns, record = cached.get(path, (None, None, None))
+        if (size, mtime_ns) == keys[path]:
+            records[path] = record
+        else:
+            todo.append(path)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if jobs <= 1 or len(todo) <= 1:
+        for path in todo:
+            records[path] = extract(path)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for path, record in zip(todo, executor.map(extract, todo, chunksize=CHUNK_SIZE)):
+                records[path] = record
+    if len(todo) > 0:
+        rows = []
+        for path in paths:
+            row = {'path': path, 'size': keys[path][0], 'mtime_ns': keys[path][1]}
+            row.update(records[path] or {})
+            rows.append(row)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        pd.DataFrame(rows).to_csv(tmp_path, index=False)
+        os.replace(tmp_path, cache_path)
+    return records
 
 def get_latest_trace_files():
     trace_files = glob('*.trace.*')
@@ -15,24 +77,17 @@ def get_latest_trace_files():
     return [(instance_id, file_info[1]) for instance_id, file_info in latest_files.items()]
 
 def extract_info (path):
-    mbox = mailbox.mbox(path)
-    begun = False
+    index = TraceIndex(path)
+    start = index.ticket_start()
+    if start is None:
+        return None
     inputs = []
     outputs = []
-    for msg in mbox:
-        #msg = message.get_payload()
-        if 'Subject' in msg:
-            subject = msg['Subject']
-            if isinstance(subject, str) and subject.startswith('New ticket'):
-                begun = True
-        if not begun:
-            continue
-        input = msg.get('M-Tokens-Input', '')
-        output = msg.get('M-Tokens-Output', '')
-        if input:
-            inputs.append(int(input))
-        if output:
-            outputs.append(int(output))
+    for entry in index.entries[start:]:
+        if entry['tokens_in'] is not None:
+            inputs.append(entry['tokens_in'])
+        if entry['tokens_out'] is not None:
+            outputs.append(entry['tokens_out'])
     if len(inputs) != len(outputs):
         assert False
     if len(inputs) == 0:
@@ -44,11 +99,50 @@ def extract_info (path):
     }
 
 
+def get_latest_metrics_files ():
+    # metrics.jsonl of the latest solve of each instance, in the
+    # INSTANCE.TIMESTAMP output directories.
+    latest_files = {}
+    for file in glob(os.path.join('*', METRICS_NAME)):
+        instance_id, _, timestamp = os.path.dirname(file).partition('.')
+        if instance_id not in latest_files or timestamp > latest_files[instance_id][0]:
+            latest_files[instance_id] = (timestamp, file)
+    return [(instance_id, file_info[1]) for instance_id, file_info in sorted(latest_files.items())]
+
+def metrics_info (path):
+    return summarize(read_metrics(path))
+
+def metrics_main (files, jobs=None):
+    records = collect([file for _, file in files], metrics_info, METRICS_CACHE, jobs)
+    df = []
+    for instance_id, file in files:
+        summary = dict(records[file])
+        summary['instance_id'] = instance_id
+        df.append(summary)
+    df = pd.DataFrame(df).set_index('instance_id')
+    pd.set_option('display.width', 200)
+    print(df.describe().T)
+    # where the time and the money go
+    print()
+    print("Totals:")
+    for column in ['cost', 'tokens_in', 'tokens_out', 'wall_seconds', 'setup_seconds', 'model_seconds', 'shell_seconds', 'test_seconds']:
+        print(f"  {column:<14} {df[column].sum():.2f}")
+
 def main ():
+    parser = argparse.ArgumentParser(description='Statistics of the solves in the current directory.')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Processes to read the files with; default all cores')
+    args = parser.parse_args()
+    files = get_latest_metrics_files()
+    if len(files) > 0:
+        metrics_main(files, args.jobs)
+        return
+    # solves from before metrics.jsonl
+    files = get_latest_trace_files()
+    records = collect([file for _, file in files], extract_info, TRACES_CACHE, args.jobs)
     df = []
-    for instance_id, file in get_latest_trace_files():
+    for instance_id, file in files:
         print(f"{instance_id}: {file}")
-        e = extract_info(file)
+        e = records[file]
         if e:
             df.append(e)
     df = pd.DataFrame(df)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+import os
+import json
+import mmap
+import pickle
+
+# The instance store replaces the monolithic datasets.pkl.
+#
+# instances.dat holds one JSON record per instance, appended one after
+# another.  instances.idx has one line per instance:
+#
+#     instance_id <TAB> split <TAB> offset <TAB> length
+#
+# The data file is memory-mapped, so looking up an instance only touches
+# the bytes of that instance.
+
+DATA_NAME = "instances.dat"
+INDEX_NAME = "instances.idx"
+LEGACY_NAME = "datasets.pkl"
+
+class InstanceStore:
+    def __init__ (self, root):
+        self.data_path = os.path.join(root, DATA_NAME)
+        self.index_path = os.path.join(root, INDEX_NAME)
+        self.index = {}     # instance_id -> (split, offset, length)
+        self.data = None
+        with open(self.index_path, 'r') as f:
+            for line in f:
+                instance_id, split, offset, length = line.rstrip('\n').split('\t')
+                # the first split wins, the same as the old datasets.pkl lookup
+                if instance_id not in self.index:
+                    self.index[instance_id] = (split, int(offset), int(length))
+
+    def close (self):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+
+    def __contains__ (self, instance_id):
+        return instance_id in self.index
+
+    def __len__ (self):
+        return len(self.index)
+
+    def ids (self, split=None):
+        return [instance_id for instance_id, entry in self.index.items() if split is None or entry[0] == split]
+
+    def splits (self):
+        return sorted(set(entry[0] for entry in self.index.values()))
+
+    def get (self, instance_id):
+        entry = self.index.get(instance_id, None)
+        if entry is None:
+            return None
+        split, offset, length = entry
+        if self.data is None:
+            with open(self.data_path, 'rb') as f:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        instance = json.loads(self.data[offset:offset+length])
+        instance['split'] = split
+        return instance
+
+    def __iter__ (self):
+        for instance_id in self.index:
+            yield self.get(instance_id)
+
+def store_exists (root):
+    return os.path.exists(os.path.join(root, INDEX_NAME))
+
+def write_store (root, datasets):
+    # datasets: {split: {instance_id: instance}}, as in the old datasets.pkl
+    # Written to temporary files first and renamed into place, so concurrent
+    # readers (or concurrent migrations) never see a half-written store.
+    suffix = f".tmp.{os.getpid()}"
+    data_path = os.path.join(root, DATA_NAME)
+    index_path = os.path.join(root, INDEX_NAME)
+    seen = set()
+    with open(data_path + suffix, 'wb') as data, open(index_path + suffix, 'w') as index:
+        for split, dataset in datasets.items():
+            for instance_id, instance in dataset.items():
+                if instance_id in seen:
+                    continue
+                seen.add(instance_id)
+                record = dict(instance)
+                record.pop('split', None)
+                blob = json.dumps(record, default=str).encode('utf-8')
+                offset = data.tell()
+                data.write(blob)
+                data.write(b'\n')
+                index.write(f"{instance_id}\t{split}\t{offset}\t{len(blob)}\n")
+    # data first: the index file is what marks the store as present
+    os.replace(data_path + suffix, data_path)
+    os.replace(index_path + suffix, index_path)
+    return len(seen)
+
+def migrate_legacy (root):
+    # Convert an existing datasets.pkl into the instance store.
+    legacy_path = os.path.join(root, LEGACY_NAME)
+    if not os.path.exists(legacy_path):
+        return False
+    with open(legacy_path, "rb") as f:
+        datasets = pickle.load(f)
+    write_store(root, datasets)
+    return True
+
+def open_store (root):
+    if not store_exists(root):
+        migrate_legacy(root)
+    assert store_exists(root), f"No instance store found in {root}; please run swe_download"
+    return InstanceStore(root)
+
+def main ():
+    import argparse
+    from aa_swe.swe import ROOT
+    parser = argparse.ArgumentParser(description='Manage the instance store.')
+    parser.add_argument('--migrate', action='store_true', help=f'Rebuild the store from {LEGACY_NAME}')
+    args = parser.parse_args()
+    if args.migrate:
+        if not migrate_legacy(ROOT):
+            print(f"{os.path.join(ROOT, LEGACY_NAME)} not found")
+            return 1
+    store = open_store(ROOT)
+    for split in store.splits():
+        print(f"{split}: {len(store.ids(split))} instances")
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,24 @@
 #!/usr/bin/env python3
-import sys
 import os
-from glob import glob
 import json
+import argparse
+from aa_swe.swe_catalog import open_catalog, attempts
 
 def main():
-    output_path = 'all_preds.jsonl'
-    if len(sys.argv) > 1:
-        output_path = sys.argv[1]
+    parser = argparse.ArgumentParser(description='Merge the patches of the solved attempts for evaluation.')
+    parser.add_argument('output', nargs='?', default='all_preds.jsonl', help='The jsonl file to write')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the results catalog from the attempt directories')
+    args = parser.parse_args()
+    output_path = args.output
     cnt = 0
+    catalog = open_catalog(rescan=args.rebuild)
     with open(output_path, 'w') as f:
-        for path in glob(os.path.join("*", "patch")):
-            parent = os.path.dirname(path)
-            instance_path = os.path.join(parent, "instance.json")
-            with open(instance_path, 'r') as f2:
-                instance = json.load(f2)
-            instance_id = instance['instance_id']
+        for attempt in attempts(catalog, 'solved'):
+            instance_id = attempt['instance_id']
+            path = os.path.join(attempt['output_dir'], 'patch')
+            if not os.path.exists(path):
+                print(f"{path} not found; the catalog is out of date, see --rebuild")
+                continue
             with open(path, 'r') as patch_file:
                 patch = patch_file.read()
             if len(patch.strip()) == 0:
@@ -27,8 +30,8 @@ def main():
             }
             f.write(json.dumps(out) + '\n')
             cnt += 1
-    print(f"Wrote {cnt} ({cnt/300:.3f}) solutions to all_preds.jsonl")
+    print(f"Wrote {cnt} ({cnt/300:.3f}) solutions to {output_path}")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+import os
+import sys
+import mmap
+import quopri
+import base64
+import pickle
+import hashlib
+import logging
+import email.policy
+from email.parser import BytesParser, BytesHeaderParser
+
+# Reading traces (the mbox files written by the engine) without parsing
+# them whole.
+#
+# A trace is indexed by one pass over its bytes: the offsets of the
+# messages ("From " lines) and of their bodies, and the few headers the
+# tools look at.  Only the headers are parsed.  The index is cached in
+# .trace_index next to the trace, and since a trace only grows, a cached
+# index is extended from its last message instead of being rebuilt when
+# the trace has grown.  Bodies and whole messages are then read by seeking
+# to the messages that are needed.
+#
+#     python3 -m aa_swe.swe_trace trace.mbox      # list the messages
+
+INDEX_DIR = '.trace_index'
+INDEX_VERSION = 1
+HEAD_SIZE = 4096                # to tell a trace that was rewritten
+SCAN_STEP = 4 << 20             # bytes scanned between progress calls
+
+# entry: dict with
+#   offset, end:        the message, from its "From " line
+#   body:               offset of the body
+#   subject, from, to:  headers, '' if missing
+#   tokens_in, tokens_out: M-Tokens-Input/Output, None if missing
+#   content_type, charset, cte: to decode the body without parsing the message
+
+def header_tokens (header, name):
+    value = header.get(name, None)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+def scan (buf, start, end, parser):
+    # Entries of the messages in buf[start:end].  start does not have to
+    # be at the beginning of a message; scanning starts at the next one.
+    # Returns (entries, offset to scan from next time).  A message with an
+    # incomplete header is being written and is left to the next time.
+    if buf[start:start+5] == b'From ':
+        off = start
+    else:
+        off = buf.find(b'\nFrom ', start, end)
+        if off < 0:
+            return [], end
+        off += 1
+    entries = []
+    while off < end:
+        next_off = buf.find(b'\nFrom ', off, end)
+        next_off = end if next_off < 0 else next_off + 1
+        header_begin = buf.find(b'\n', off, next_off) + 1
+        header_end = buf.find(b'\n\n', header_begin - 1, next_off)
+        if header_begin == 0 or header_end < 0:
+            return entries, off
+        header = parser.parsebytes(buf[header_begin:header_end + 1])
+        content_type = header.get_content_type()
+        entries.append({
+            'offset': off,
+            'end': next_off,
+            'body': header_end + 2,
+            'subject': str(header.get('Subject', '') or ''),
+            'from': str(header.get('From', '') or ''),
+            'to': str(header.get('To', '') or ''),
+            'tokens_in': header_tokens(header, 'M-Tokens-Input'),
+            'tokens_out': header_tokens(header, 'M-Tokens-Output'),
+            'content_type': content_type,
+            'charset': header.get_content_charset() or 'utf-8',
+            'cte': str(header.get('Content-Transfer-Encoding', '') or '').lower(),
+        })
+        off = next_off
+    return entries, end
+
+def cache_path (path):
+    return os.path.join(os.path.dirname(os.path.abspath(path)), INDEX_DIR, os.path.basename(path) + '.pkl')
+
+class TraceIndex:
+    def __init__ (self, path, cache=True, on_progress=None):
+        self.path = path
+        self.cache = cache
+        self.parser = BytesHeaderParser(policy=email.policy.default)
+        self.size = 0
+        self.mtime = None
+        self.head = None
+        self.entries = []
+        if cache:
+            self.load_cache()
+        self.update(on_progress)
+
+    def load_cache (self):
+        path = cache_path(self.path)
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, 'rb') as f:
+                cached = pickle.load(f)
+        except Exception as e:
+            logging.warning(f"ignoring broken trace index {path}: {e}")
+            return
+        if cached.get('version', None) != INDEX_VERSION:
+            return
+        self.size = cached['size']
+        self.mtime = cached['mtime']
+        self.head = cached['head']
+        self.entries = cached['entries']
+
+    def save_cache (self):
+        path = cache_path(self.path)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({'version': INDEX_VERSION, 'size': self.size, 'mtime': self.mtime,
+                             'head': self.head, 'entries': self.entries}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # e.g. a read-only results directory; the index is just not kept
+            logging.warning(f"cannot write trace index {path}: {e}")
+
+    def update (self, on_progress=None):
+        # Indexes what was appended to the trace since the last time.
+        # Returns the number of new messages.  on_progress is called with
+        # the entries so far as the scan goes through a large trace.
+        st = os.stat(self.path)
+        if st.st_size == self.size and st.st_mtime == self.mtime:
+            return 0
+        with open(self.path, 'rb') as f:
+            head = hashlib.sha1(f.read(min(HEAD_SIZE, self.size))).hexdigest()
+            if st.st_size < self.size or head != self.head:
+                # not the trace that was indexed
+                self.size = 0
+                self.entries = []
+            n = len(self.entries)
+            if st.st_size > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                    # the last message may have grown
+                    start = self.entries.pop()['offset'] if len(self.entries) > 0 else 0
+                    stop = start
+                    while stop < st.st_size:
+                        stop = min(st.st_size, stop + max(SCAN_STEP, stop - start))
+                        entries, _ = scan(buf, start, stop, self.parser)
+                        if stop < st.st_size:
+                            # the last message may go on past stop
+                            if len(entries) <= 1:
+                                continue
+                            start = entries.pop()['offset']
+                        self.entries.extend(entries)
+                        if on_progress is not None:
+                            on_progress(self.entries)
+                    self.head = hashlib.sha1(buf[:min(HEAD_SIZE, st.st_size)]).hexdigest()
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        if self.cache:
+            self.save_cache()
+        return len(self.entries) - n
+
+    def __len__ (self):
+        return len(self.entries)
+
+    def __getitem__ (self, i):
+        return self.entries[i]
+
+    def __iter__ (self):
+        return iter(self.entries)
+
+    def ticket_start (self, last=False):
+        # Index of the first (or last) "New ticket" message, where the
+        # solve proper begins after the replayed memory; None if none.
+        found = None
+        for i, entry in enumerate(self.entries):
+            if entry['subject'].startswith('New ticket'):
+                found = i
+                if not last:
+                    break
+        return found
+
+    def message (self, i):
+        return read_message(self.path, self.entries[i])
+
+    def headers (self, i):
+        return read_headers(self.path, self.entries[i])
+
+    def body (self, i, limit=None):
+        return read_body(self.path, self.entries[i], limit)
+
+# Readers of one message by its entry, which can be used while another
+# thread is still indexing the trace.
+
+def read_bytes (path, begin, end):
+    with open(path, 'rb') as f:
+        f.seek(begin)
+        return f.read(end - begin)
+
+def read_message (path, entry):
+    # The whole message, parsed.
+    data = read_bytes(path, entry['offset'], entry['end'])
+    data = data[data.find(b'\n') + 1:]      # the "From " line
+    return BytesParser(policy=email.policy.default).parsebytes(data)
+
+def read_headers (path, entry):
+    # [(name, value)] of all the headers.
+    data = read_bytes(path, entry['offset'], entry['body'])
+    data = data[data.find(b'\n') + 1:]
+    return BytesHeaderParser(policy=email.policy.default).parsebytes(data).items()
+
+def read_body (path, entry, limit=None):
+    # The decoded text of the body.  With limit, only the first limit
+    # bytes (of the encoded body) are read.
+    if entry['content_type'].startswith('multipart/'):
+        message = read_message(path, entry)
+        parts = []
+        for part in message.walk():
+            if part.get_content_maintype() == 'text':
+                parts.append(part.get_content())
+        text = '\n'.join(parts)
+        return text if limit is None else text[:limit]
+    end = entry['end']
+    if limit is not None:
+        end = min(end, entry['body'] + limit)
+    data = read_bytes(path, entry['body'], end)
+    if entry['cte'] == 'base64':
+        data = b''.join(data.split())
+        # whole groups only, if cut by the limit
+        data = base64.b64decode(data[:len(data) - len(data) % 4])
+    elif entry['cte'] == 'quoted-printable':
+        data = quopri.decodestring(data)
+    try:
+        return data.decode(entry['charset'], errors='ignore')
+    except LookupError:
+        return data.decode('utf-8', errors='ignore')
+
+def main ():
+    for path in sys.argv[1:]:
+        index = TraceIndex(path)
+        start = index.ticket_start()
+        for i, entry in enumerate(index):
+            mark = '*' if i == start else ' '
+            print(f"{mark}{i:4d} {entry['offset']:10d} {entry['end'] - entry['body']:8d} "
+                  f"{entry['tokens_in'] or '':>7} {entry['tokens_out'] or '':>6} {entry['subject']}")
+
+if __name__ == "__main__":
+    main()